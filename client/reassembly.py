@@ -0,0 +1,304 @@
+"""
+Reassembly of chunked messages received from peers.
+
+A message is sent as chunk_total chunks of RAW_CHUNK_SIZE bytes of the content
+(the last one may be shorter), base64 in JSON or raw in binary frames (see
+framing.py), so chunk i always lands at offset i * RAW_CHUNK_SIZE. Every chunk
+is decoded on arrival and written at its offset, either into a bytearray that
+grows with the chunks received or, for messages larger than SPILL_SIZE, into a
+temporary file. A bitmap of received chunks makes duplicates and completion
+O(1) checks, whatever order the chunks come in.
+
+chunk_total comes from the peer, so nothing is allocated for chunks that have
+not arrived: buffers only grow up to the furthest chunk received, all buffers
+together stay under MAX_MEMORY (messages that would go beyond are moved to a
+temporary file), and incomplete messages are dropped after PENDING_TIMEOUT
+seconds without a chunk or past MAX_PENDING messages per peer.
+"""
+import base64
+import binascii
+import os
+import tempfile
+import time
+
+CHUNK_SIZE = 8000  # base64 characters per chunk
+RAW_CHUNK_SIZE = CHUNK_SIZE // 4 * 3  # bytes encoded into one chunk, a multiple of 3 so the chunks concatenate to one base64 string
+SPILL_SIZE = 32 * 1024 * 1024  # messages larger than this are written to a temporary file instead of memory
+MAX_CHUNKS = 1 << 24  # refuse messages announcing more chunks than this (about 100 GB)
+MAX_MEMORY = 64 * 1024 * 1024  # bytes of incomplete messages kept in memory, over all peers
+MAX_PENDING = 16  # incomplete messages per peer
+PENDING_TIMEOUT = 120  # seconds without a chunk after which an incomplete message is dropped
+
+
+class Reassembly:
+    """
+    One message being received.
+
+    Attributes:
+        msg_type (str): "text" or "file".
+        name (str): Name of the file, for files.
+        chunk_total (int): Number of chunks of the message.
+        size (int): Bytes received so far that belong to the content, its length once complete.
+        path (str): Temporary file holding the content, None when it is kept in memory.
+        touched (float): time.monotonic() of the last chunk.
+    """
+
+    def __init__(self, msg_type, chunk_total, name=None):
+        self.msg_type = msg_type
+        self.name = name
+        self.chunk_total = chunk_total
+        self.received = bytearray((chunk_total + 7) // 8)  # bit i set once chunk i is written
+        self.count = 0
+        self.size = 0
+        self.touched = time.monotonic()
+        self.path = None
+        self.file = None
+        self.buffer = bytearray()  # grows up to the end of the furthest chunk received
+        if chunk_total * RAW_CHUNK_SIZE > SPILL_SIZE:
+            self.spill()
+
+    @property
+    def complete(self):
+        return self.count == self.chunk_total
+
+    @property
+    def memory(self):
+        """
+        Bytes of the in-memory buffer, 0 once spilled.
+        """
+        return len(self.buffer) if self.buffer is not None else 0
+
+    def growth(self, index):
+        """
+        Bytes the in-memory buffer grows by to hold chunk index, at most.
+        """
+        if self.buffer is None:
+            return 0
+        return max(0, (index + 1) * RAW_CHUNK_SIZE - len(self.buffer))
+
+    def spill(self):
+        """
+        Move the content to a temporary file and write the next chunks there.
+        """
+        fd, self.path = tempfile.mkstemp(prefix="cryptic-", suffix=".part")
+        self.file = os.fdopen(fd, "r+b")
+        if self.buffer:
+            self.file.write(self.buffer)
+        self.buffer = None
+
+    def add(self, index, b64_content):
+        """
+        Decode one chunk and write it at its offset.
+
+        Args:
+            index (int): Index of the chunk.
+            b64_content (str): Its base64 content.
+
+        Returns:
+            bool: False if the chunk was a duplicate and was ignored.
+
+        Raises:
+            ValueError: If the chunk is not base64 or add_raw refuses it.
+        """
+        try:
+            raw = base64.b64decode(b64_content, validate=True)
+        except (binascii.Error, TypeError) as e:
+            raise ValueError(f"chunk {index} is not base64: {e}") from None
+        return self.add_raw(index, raw)
+
+    def add_raw(self, index, raw):
+        """
+        Write one decoded chunk at its offset.
+
+        Args:
+            index (int): Index of the chunk.
+            raw (bytes): Its content.
+
+        Returns:
+            bool: False if the chunk was a duplicate and was ignored.
+
+        Raises:
+            ValueError: If the chunk is out of range, or not RAW_CHUNK_SIZE bytes long
+                when it is not the last one.
+        """
+        if not 0 <= index < self.chunk_total:
+            raise ValueError(f"chunk {index} out of range")
+        byte, bit = divmod(index, 8)
+        if self.received[byte] & (1 << bit):
+            return False
+        last = index == self.chunk_total - 1
+        if len(raw) > RAW_CHUNK_SIZE or (not last and len(raw) != RAW_CHUNK_SIZE):
+            raise ValueError(f"chunk {index} has {len(raw)} bytes")
+        offset = index * RAW_CHUNK_SIZE
+        if self.file is not None:
+            self.file.seek(offset)
+            self.file.write(raw)
+        else:
+            if len(self.buffer) < offset:
+                self.buffer += bytes(offset - len(self.buffer))  # the chunks before this one are still missing
+            self.buffer[offset:offset + len(raw)] = raw
+        self.received[byte] |= 1 << bit
+        self.count += 1
+        self.touched = time.monotonic()
+        # Every chunk but the last is full, so the length is known once the last one is in
+        self.size = offset + len(raw) if last else max(self.size, offset + len(raw))
+        return True
+
+    def content(self):
+        """
+        The content of a complete message, read back from the temporary file if it
+        was spilled. Use save() for files, which may not fit in memory.
+
+        Returns:
+            bytes: The content.
+        """
+        if self.file is not None:
+            self.file.seek(0)
+            return self.file.read(self.size)
+        return bytes(memoryview(self.buffer)[:self.size])
+
+    def save(self, filepath):
+        """
+        Move the content of a complete message to filepath. A spilled message is
+        renamed rather than copied when filepath is on the same filesystem.
+
+        Args:
+            filepath (str): Where to save the content.
+        """
+        if self.file is None:
+            with open(filepath, "wb") as f:
+                f.write(memoryview(self.buffer)[:self.size])
+            return
+        self.file.truncate(self.size)
+        self.file.close()
+        self.file = None
+        try:
+            os.replace(self.path, filepath)
+        except OSError:
+            # another filesystem: copy, then drop the temporary file
+            with open(self.path, "rb") as src, open(filepath, "wb") as dst:
+                while block := src.read(1 << 20):
+                    dst.write(block)
+            os.remove(self.path)
+        self.path = None
+
+    def discard(self):
+        """
+        Release the buffer or delete the temporary file.
+        """
+        self.buffer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class Reassembler:
+    """
+    Messages being received, by peer and message ID.
+    """
+
+    def __init__(self):
+        self.pending = {}  # peer_id -> {msg_id: Reassembly}
+        self.memory = 0  # bytes of the in-memory buffers of pending messages
+
+    def add(self, peer_id, data):
+        """
+        Add one chunk received from a peer.
+
+        Args:
+            peer_id (str): The sending peer.
+            data (dict): The chunk: msg_id, chunk_index, chunk_total, type, content and name.
+
+        Returns:
+            Reassembly: The message once its last chunk is in, None before. The caller
+            owns it from then on and must save or discard it.
+
+        Raises:
+            ValueError: If the chunk is invalid. The message it belongs to is dropped.
+        """
+        message = self._message(peer_id, data["msg_id"], data.get("type", "text"), int(data.get("chunk_total", 1)))
+        return self._added(peer_id, data["msg_id"], message.add, int(data.get("chunk_index", 0)), data.get("content", ""), data.get("name"))
+
+    def add_frame(self, peer_id, frame):
+        """
+        Add one chunk received as a binary frame, see framing.py.
+
+        Args:
+            peer_id (str): The sending peer.
+            frame (framing.Frame): The opened frame.
+
+        Returns:
+            Reassembly: As for add.
+
+        Raises:
+            ValueError: If the chunk is invalid. The message it belongs to is dropped.
+        """
+        message = self._message(peer_id, frame.msg_id, frame.msg_type, frame.total)
+        return self._added(peer_id, frame.msg_id, message.add_raw, frame.index, frame.chunk, frame.name)
+
+    def drop_peer(self, peer_id):
+        """
+        Discard the incomplete messages of a peer, e.g. when its connection closes.
+        """
+        for message in self.pending.pop(peer_id, {}).values():
+            self.memory -= message.memory
+            message.discard()
+
+    def clear(self):
+        for peer_id in list(self.pending):
+            self.drop_peer(peer_id)
+
+    def expire(self, now=None):
+        """
+        Discard the incomplete messages that got no chunk for PENDING_TIMEOUT seconds.
+        """
+        deadline = (time.monotonic() if now is None else now) - PENDING_TIMEOUT
+        for peer_id, peer_msgs in list(self.pending.items()):
+            for msg_id, message in list(peer_msgs.items()):
+                if message.touched < deadline:
+                    self._pop(peer_id, msg_id).discard()
+
+    def _message(self, peer_id, msg_id, msg_type, chunk_total):
+        message = self.pending.get(peer_id, {}).get(msg_id)
+        if message is None:
+            if not 0 < chunk_total <= MAX_CHUNKS:
+                raise ValueError(f"invalid chunk_total {chunk_total}")
+            if msg_type == "text" and chunk_total * RAW_CHUNK_SIZE > SPILL_SIZE:
+                raise ValueError(f"text message of {chunk_total} chunks is too large")
+            self.expire()
+            if len(self.pending.get(peer_id, ())) >= MAX_PENDING:
+                raise ValueError(f"more than {MAX_PENDING} messages in progress")
+            message = self.pending.setdefault(peer_id, {})[msg_id] = Reassembly(msg_type, chunk_total)
+        return message
+
+    def _added(self, peer_id, msg_id, add, index, content, name):
+        message = self.pending[peer_id][msg_id]
+        if self.memory + message.growth(index) > MAX_MEMORY:
+            self.memory -= message.memory
+            message.spill()
+        before = message.memory
+        try:
+            add(index, content)
+        except ValueError:
+            self._pop(peer_id, msg_id).discard()
+            raise
+        self.memory += message.memory - before
+        if name:
+            message.name = name
+        if not message.complete:
+            return None
+        return self._pop(peer_id, msg_id)
+
+    def _pop(self, peer_id, msg_id):
+        peer_msgs = self.pending[peer_id]
+        message = peer_msgs.pop(msg_id)
+        if not peer_msgs:
+            del self.pending[peer_id]
+        self.memory -= message.memory
+        return message
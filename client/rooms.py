@@ -3,6 +3,7 @@ import json
 import logging
 import os
 from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.sdp import candidate_from_sdp, candidate_to_sdp
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
@@ -14,11 +15,30 @@ import websockets
 import tkinter as tk
 from tkinter import filedialog
 import tempfile
+import itertools
 import math, uuid
+import random
 import media
+import sdpz
+import framing
+from cryptosession import BATCH, CRYPTO_POOL, CryptoSession
+from sendwindow import SEND_LOW_WATER, SEND_WINDOW, SendWindow
+from reassembly import RAW_CHUNK_SIZE, Reassembler, Reassembly
+
+try:
+    import msgpack  # optional, signaling frames are sent as MessagePack when the server supports it
+except ImportError:
+    msgpack = None
 
 CONFIG_FILE = "config.json"
-CHUNK_SIZE = 8000
+READ_BUFFER = 1 << 20  # file read buffer when streaming a file
+ICE_BATCH_WINDOW = 0.02 # seconds local ICE candidates are collected before being sent as one frame
+# Websocket subprotocols selecting the signaling encoding, in order of preference
+SIGNALING_PROTOCOLS = (["cryptic.msgpack"] if msgpack else []) + ["cryptic.json"]
+WS_COMPRESSION = "deflate"  # permessage-deflate on the signaling websocket, None turns it off
+RECONNECT_DELAY = 0.5  # upper bound of the first wait before reconnecting, doubled after each failure
+RECONNECT_MAX_DELAY = 8
+RECONNECT_ATTEMPTS = 8
 
 def generate_rsa_keys():
     """
@@ -63,24 +83,80 @@ def to_websocket_url(url):
     ws_scheme = "wss" if scheme == "https" else "ws"
     return f"{ws_scheme}://{rest.rstrip('/')}/ws"
 
-def get_file_path(filename, file_bytes):
+def retry_after(exc):
     """
-    Save raw bytes as a temporary file and return the path.
+    The Retry-After of a websocket handshake the server turned away because it is busy.
 
     Args:
-        filename (str): Name of the file to create.
-        file_bytes (bytes): Raw binary content.
+        exc (Exception): The error raised by websockets.connect.
 
     Returns:
-        str: Path to the saved temporary file.
+        float | None: Seconds to wait, or None if the server did not ask for a wait.
+    """
+    response = getattr(exc, "response", None)  # InvalidStatus, or InvalidStatusCode in older websockets
+    status = getattr(response, "status_code", None) or getattr(exc, "status_code", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None)
+    if status != 503 or headers is None:
+        return None
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def memory_chunks(content: bytes):
+    """
+    Yield content RAW_CHUNK_SIZE bytes at a time, without copying it.
+
+    Args:
+        content (bytes): Raw binary content.
+
+    Yields:
+        memoryview: One chunk, a single empty one for empty content.
     """
-    tmp_dir = tempfile.gettempdir()
-    filepath = os.path.join(tmp_dir, filename)
+    view = memoryview(content)
+    for start in range(0, max(1, len(view)), RAW_CHUNK_SIZE):
+        yield view[start:start + RAW_CHUNK_SIZE]
 
-    with open(filepath, "wb") as f:
-        f.write(file_bytes)
+def file_chunks(path):
+    """
+    Yield a file RAW_CHUNK_SIZE bytes at a time, reading it as it goes so that
+    only one chunk is in memory whatever the size of the file.
+
+    Args:
+        path (str): Path of the file.
+
+    Yields:
+        bytes: One chunk, a single empty one for an empty file.
+    """
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        block = f.read(RAW_CHUNK_SIZE)
+        yield block
+        while block := f.read(RAW_CHUNK_SIZE):
+            yield block
+
+def take(chunks, n):
+    """
+    The next n chunks of an iterator, fewer at its end.
+    """
+    return list(itertools.islice(chunks, n))
+
+def chunk_count(size):
+    """
+    Number of chunks a message of size bytes is sent in.
+    """
+    return max(1, math.ceil(size / RAW_CHUNK_SIZE))
+
+def download_path(filename):
+    """
+    Path a received file is saved to, in the temporary directory.
+
+    Args:
+        filename (str): Name of the file as sent by the peer, any directory part is dropped.
 
-    return filepath
+    Returns:
+        str: Path of the file.
+    """
+    return os.path.join(tempfile.gettempdir(), os.path.basename(filename) or "unknown")
 
 class ChatClient:
     """
@@ -101,10 +177,17 @@ class ChatClient:
         self.load_config()
         self.peers = {}       # peer_id -> RTCPeerConnection
         self.channels = {}    # peer_id -> DataChannel
-        self.chunk_buffers = {} # peer_id -> list of chunks
-        self.keys = {}
+        self.send_windows = {}  # peer_id -> SendWindow of its DataChannel
+        self.reassembler = Reassembler()  # chunked messages being received, see reassembly.py
+        self.ice_outbox = {}  # peer_id -> local ICE candidates not sent yet
+        self.peer_features = {}  # peer_id -> optional features the peer advertised on join
+        self.crypto = {}  # peer_id -> CryptoSession, once the Fernet key is known
+        self.inbox = {}  # peer_id -> messages received but not opened yet, see handle_message
         self.channel_open = False
         self.ws = None
+        self.server_url = None
+        self.resume_token = None  # from created/joined/resumed, gets our room membership back after a drop
+        self.rejoining = False  # joining again after "Session not found", see listen_server
         self.rsapriv, self.rsapub = generate_rsa_keys()
         self.commands = {
             "sendfile": self.cmd_sendfile
@@ -145,11 +228,24 @@ class ChatClient:
             print("No file selected.")
             return
 
-        # Read the file in binary
-        with open(filepath, "rb") as f:
-            data = f.read()
+        # The file is read while it is sent, see send_file
+        asyncio.create_task(self.send_file(filepath))
+
+    def send_window(self, channel):
+        """
+        Flow control for a new data channel, see sendwindow.py. The window and the
+        point where sending resumes are the "send_window" and "send_low_water"
+        entries of the config, in bytes.
 
-        asyncio.create_task(self.send_message("file", data, filename=os.path.basename(filepath)))
+        Args:
+            channel (RTCDataChannel): The channel.
+
+        Returns:
+            SendWindow: Its send window.
+        """
+        window = int(self.config.get("send_window", SEND_WINDOW))
+        low = int(self.config.get("send_low_water", min(SEND_LOW_WATER, window // 4)))
+        return SendWindow(channel, window, low)
 
     def encrypt_message(self, peer_id, plaintext):
         """
@@ -162,9 +258,7 @@ class ChatClient:
         Returns:
             str: The encrypted message (base64 string).
         """
-        fernet = Fernet(self.keys[peer_id])
-        token = fernet.encrypt(plaintext.encode())
-        return token.decode("ascii")
+        return self.crypto[peer_id].encrypt(plaintext)
 
     def decrypt_message(self, peer_id, token):
         """
@@ -177,50 +271,111 @@ class ChatClient:
         Returns:
             str: The decrypted plaintext.
         """
-        fernet = Fernet(self.keys[peer_id])
-        return fernet.decrypt(token.encode("ascii")).decode("utf-8")
+        return self.crypto[peer_id].decrypt(token)
 
     async def listen_server(self):
         """
         Listen for messages from the signaling server and handle events.
+        If the connection drops, reconnect and resume the session: the peer
+        connections do not depend on the signaling server and stay up.
         """
-        async for raw in self.ws:
+        said_bye = False
+        while not said_bye:
             try:
-                data = json.loads(raw)
-            except Exception:
-                continue
-            t = data.get("type")
-            if t == "error":
-                print("Server error:", data.get("message"))
-            elif t == "created":
-                print(f"Room {data.get('room')} created")
-            # Setup connections
-            elif t == "gotjoined":
-                if self.ishost:
-                    user = data.get("user")
-                    print(f"{user} is joining the room")
-                    # Connect to all peers in room
-                    new_peer = user
-                    if new_peer:
-                        logging.info("Received offer_request for %s — creating PEER connection", new_peer)
-                        await self.setup_host_peer(new_peer)
-            elif t == 'joined':
-                host_id = data.get("user")
-                print(f"Joined room {data.get('room')} (host: {host_id})")
-                await self.setup_client_peer(host_id)
-
-            elif t in ("offer", "answer"):
-                sender = data.get("from")
-                if sender != self.name:
-                    await self.handle_signaling(sender, data)
-
-            elif t == "bye":
-                logging.info("Peer said BYE — exiting")
+                async for raw in self.ws:
+                    try:
+                        data = msgpack.unpackb(raw) if isinstance(raw, bytes) else json.loads(raw)
+                    except Exception:
+                        continue
+                    t = data.get("type")
+                    if t == "error":
+                        message = data.get("message")
+                        if message == "Session not found":
+                            # Offline for longer than the server keeps members, join again
+                            self.resume_token = None
+                            self.rejoining = True
+                            await self.send_join()
+                        elif self.rejoining and self.create and message == "Room already exists":
+                            # The other members kept our room alive: join it instead of creating it
+                            self.create = False
+                            await self.send_join()
+                        elif self.rejoining and self.ishost and not self.create and message == "Room not found":
+                            # Everybody left our room meanwhile, create it again
+                            self.create = True
+                            await self.send_join()
+                        else:
+                            print("Server error:", data.get("message"))
+                    elif t == "created":
+                        self.resume_token = data.get("resume_token")
+                        self.rejoining = False
+                        print(f"Room {data.get('room')} created")
+                    elif t == "resumed":
+                        self.resume_token = data.get("resume_token")
+                        logging.info("Resumed the signaling session in room %s", data.get("room"))
+                    # Setup connections
+                    elif t == "gotjoined":
+                        if self.ishost:
+                            user = data.get("user") or {}
+                            new_peer = user.get("username")
+                            self.peer_features[new_peer] = set(user.get("features", []))
+                            print(f"{new_peer} is joining the room")
+                            # Connect to all peers in room
+                            if new_peer and self.peer_alive(new_peer):
+                                # Joined again after losing the server, the peer connection did not need it
+                                logging.info("%s joined again, keeping its peer connection", new_peer)
+                            elif new_peer:
+                                await self.drop_peer(new_peer)
+                                logging.info("Received offer_request for %s — creating PEER connection", new_peer)
+                                await self.setup_host_peer(new_peer)
+                    elif t == "user-left":
+                        # Its peer connection is kept until it fails: the peer may only have lost the server
+                        self.peer_features.pop(data.get("user"), None)
+                    elif t == 'joined':
+                        host_id = data.get("user")
+                        self.resume_token = data.get("resume_token")
+                        self.rejoining = False
+                        for client in data.get("clients", []):
+                            self.peer_features[client.get("username")] = set(client.get("features", []))
+                        print(f"Joined room {data.get('room')} (host: {host_id})")
+                        if self.ishost:
+                            # Back in our own room as a member: offer again to those whose connection did not survive
+                            for client in data.get("clients", []):
+                                peer_id = client.get("username")
+                                if peer_id and not self.peer_alive(peer_id):
+                                    await self.drop_peer(peer_id)
+                                    await self.setup_host_peer(peer_id)
+                        elif self.peer_alive(host_id):
+                            # Joined again after "Session not found", the host kept its end of the connection
+                            logging.info("Keeping the peer connection with %s", host_id)
+                        else:
+                            await self.drop_peer(host_id)
+                            await self.setup_client_peer(host_id)
+
+                    elif t in ("offer", "answer"):
+                        sender = data.get("from")
+                        if sender != self.name:
+                            await self.handle_signaling(sender, data)
+
+                    elif t in ("ice", "ice-batch"):
+                        sender = data.get("from") or data.get("from_user")
+                        if sender != self.name and data.get("to") in (None, self.name):
+                            await self.add_ice_candidates(sender, data)
+
+                    elif t == "bye":
+                        logging.info("Peer said BYE — exiting")
+                        said_bye = True
+                        break
+            except websockets.ConnectionClosed as e:
+                logging.info("Signaling connection lost: %s", e)
+            if not said_bye and self.resume_token:
+                await self.connect_server(self.server_url, resume=True)
+            else:
                 break
 
         # Close all connections
-        for pc in self.peers.values():
-            await pc.close()
+        for peer_id in list(self.peers):
+            await self.drop_peer(peer_id)
+        self.reassembler.clear()
 
     def get_server_info(self):
         """
@@ -274,14 +429,64 @@ class ChatClient:
                     self.save_config()
                     return self.config["server_url"]
 
-    async def connect_server(self, url):
+    async def connect_server(self, url, resume=False):
         """
-        Connect to the signaling server via WebSocket.
+        Connect to the signaling server via WebSocket. The encoding of the
+        signaling frames is negotiated with the websocket subprotocol and
+        permessage-deflate with the extension header.
+
+        A server that is busy answers 503 with a Retry-After, which is always
+        honoured. When resuming after a dropped connection, any failure is
+        retried with exponential backoff and full jitter (a random wait up to
+        the backoff), so that clients dropped together by a server restart do
+        not all come back at once. The session is then resumed with the resume
+        token, which costs one round trip instead of a new join and renegotiation.
 
         Args:
             url (str): The server URL.
+            resume (bool): Reconnect and resume the current session.
+
+        Raises:
+            OSError: If the server cannot be reached.
+            websockets.InvalidHandshake: If the server refused the connection
+                RECONNECT_ATTEMPTS times.
+        """
+        self.server_url = url
+        delay = RECONNECT_DELAY
+        if resume:
+            await asyncio.sleep(random.uniform(0, delay))
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                self.ws = await websockets.connect(
+                    to_websocket_url(url),
+                    subprotocols=SIGNALING_PROTOCOLS,
+                    compression=WS_COMPRESSION
+                )
+                break
+            except (OSError, websockets.InvalidHandshake) as e:
+                wait = retry_after(e)
+                if attempt + 1 == RECONNECT_ATTEMPTS or (wait is None and not resume):
+                    raise
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                if wait is None:
+                    wait = random.uniform(0, delay)
+                logging.info("Signaling server unavailable (%s), retrying in %.1fs", e, wait)
+                await asyncio.sleep(wait)
+        if resume:
+            await self.send_signal({"type": "resume", "token": self.resume_token})
+
+    async def send_signal(self, payload):
         """
-        self.ws = await websockets.connect(to_websocket_url(url))
+        Send a signaling message in the encoding negotiated with the server:
+        MessagePack in a binary frame, or JSON text for servers without it.
+
+        Args:
+            payload (dict): The signaling message.
+        """
+        if self.ws.subprotocol == "cryptic.msgpack":
+            await self.ws.send(msgpack.packb(payload))
+        else:
+            await self.ws.send(json.dumps(payload))
 
     async def join_room(self):
         """
@@ -309,14 +514,20 @@ class ChatClient:
                 self.ishost = False
                 break
 
-        await self.ws.send(json.dumps({
+        await self.send_join()
+
+    async def send_join(self):
+        """
+        Send the join (or create) request for the chosen room.
+        """
+        await self.send_signal({
             "type": "join",
             "room": self.room,
             "from": self.name,
             "password": self.password,
-            "create": self.create
-        }))
-        return
+            "create": self.create,
+            "features": ["ice-batch", sdpz.SDPZ]  # ICE candidates may be coalesced, SDP may be compressed
+        })
 
     async def async_input_loop(self):
         """
@@ -346,164 +557,181 @@ class ChatClient:
         Universal approach: everything is base64-encoded first.
         content must already be bytes.
         """
-        # Base64 encode entire content
-        full_b64 = base64.b64encode(content).decode("ascii")
-        total_len = len(full_b64)
-        chunk_total = math.ceil(total_len / CHUNK_SIZE)
-        msg_id = str(uuid.uuid4())
-        for i in range(chunk_total):
-            start = i * CHUNK_SIZE
-            end = start + CHUNK_SIZE
-            chunk_content = full_b64[start:end]
-
-            chunk_payload = {
-                "type": msg_type,
-                "msg_id": msg_id,
-                "chunk_index": i,
-                "chunk_total": chunk_total,
-                "content": chunk_content
-            }
-            if filename:
-                chunk_payload["name"] = filename
-
-            json_payload = json.dumps(chunk_payload)
-
-            if self.ishost:
-                for other_id, ch in self.channels.items():
-                    ch.send(self.encrypt_message(other_id, json_payload))
-            else:
-                self.channels[self.host_id].send(self.encrypt_message(self.host_id, json_payload))
+        await self.send_chunks(msg_type, memory_chunks(content), chunk_count(len(content)), filename)
 
-    def _reconstruct_chunks(self, peer_id, msg_id):
+    async def send_file(self, filepath):
         """
-        Reconstruct chunks from message ID but DO NOT decode.
-        Returns a dict like:
-        {"type": "text" or "file", "content": <base64 string>, "name": optional}
-        Assumes all expected chunks are present in the buffer.
+        Send a file to peers without loading it: it is read, encoded and encrypted
+        one chunk at a time, so memory use does not grow with the size of the file.
+
+        Args:
+            filepath (str): Path of the file to send.
         """
-        peer_buf = self.chunk_buffers.get(peer_id, {})
-        chunks = peer_buf.get(msg_id)
-        if not chunks:
-            return None
         try:
-            # Ensure we have unique chunk_index -> chunk mapping (ignore duplicate arrivals)
-            idx_map = {}
-            for c in chunks:
-                idx = c.get("chunk_index", 0)
-                # prefer the first received chunk for a particular index
-                if idx not in idx_map:
-                    idx_map[idx] = c
-
-            # Build ordered list by index
-            ordered = [idx_map[i] for i in sorted(idx_map.keys())]
-
-            combined = {"type": ordered[0].get("type", "text")}
-
-            # Join base64 fragments in order WITHOUT decoding
-            b64_full = "".join(chunk["content"] for chunk in ordered)
-            combined["content"] = b64_full
-
-            if combined["type"] == "file":
-                # preserve original filename if present
-                combined["name"] = ordered[0].get("name", "unknown")
-
-            # Cleanup buffer for this msg_id
-            peer_buf.pop(msg_id, None)
-            if not peer_buf:
-                self.chunk_buffers.pop(peer_id, None)
-            return combined
-        except Exception as e:
-            print(f"Error reconstructing chunks for {peer_id} msg_id {msg_id}: {e}")
-            # attempt best-effort cleanup
-            try:
-                peer_buf.pop(msg_id, None)
-                if not peer_buf:
-                    self.chunk_buffers.pop(peer_id, None)
-            except Exception:
-                pass
-            return None
+            size = os.path.getsize(filepath)
+            await self.send_chunks("file", file_chunks(filepath), chunk_count(size), os.path.basename(filepath))
+        except OSError as e:
+            print(f"Failed to send {filepath}: {e}")
+
+    async def send_chunks(self, msg_type, chunks, chunk_total, filename=None):
+        """
+        Encrypt and send chunks as they come from the chunks iterator: as binary
+        frames to peers that negotiated them (see framing.py), as Fernet-encrypted
+        JSON with base64 content to the others. Chunks are read and encrypted BATCH
+        at a time on CRYPTO_POOL, so the event loop only sends them. Each send
+        waits for room in the channel's SendWindow, so a large file is never
+        queued whole and is read no faster than the network takes it. Peers whose
+        channel is not open, or closes during the transfer, are skipped and the
+        others still get the whole message.
+
+        Args:
+            msg_type (str): "text" or "file".
+            chunks (Iterable[bytes]): Content of every chunk, in order.
+            chunk_total (int): Number of chunks.
+            filename (str): Name of the file, for files.
+        """
+        loop = asyncio.get_running_loop()
+        msg_id = uuid.uuid4()
+        # Peers joining during the transfer would only get its end, the message goes to the current ones
+        if self.ishost:
+            peer_ids = list(self.channels)
+        else:
+            peer_ids = [self.host_id]
+        targets = [
+            (peer_id, self.send_windows[peer_id], self.crypto[peer_id]) for peer_id in peer_ids
+            if peer_id in self.crypto and peer_id in self.send_windows
+            and self.send_windows[peer_id].channel.readyState == "open"
+        ]
+        chunks = iter(chunks)
+        index = 0
+        while targets:
+            batch = await loop.run_in_executor(CRYPTO_POOL, take, chunks, BATCH)
+            if not batch:
+                break
+            sealed = await asyncio.gather(*(
+                loop.run_in_executor(CRYPTO_POOL, session.seal_batch, msg_type, msg_id, index, chunk_total, batch, filename)
+                for _, _, session in targets
+            ))
+            closed = set()
+            for i in range(len(batch)):
+                for (peer_id, window, _), messages in zip(targets, sealed):
+                    if peer_id not in closed and not await window.send(messages[i]):
+                        closed.add(peer_id)
+                        logging.warning("Channel with %s closed, it will not get the rest of message %s", peer_id, msg_id)
+            targets = [target for target in targets if target[0] not in closed]
+            index += len(batch)
 
     def handle_message(self, peer_id, msg):
         """
-        Handle a received encrypted message from a peer, including numeric chunked messages.
-        The reconstructor returns base64 content only; decoding happens here.
+        Handle a received encrypted message from a peer, including chunked messages.
+        Messages are queued per peer and opened BATCH at a time on CRYPTO_POOL by
+        open_messages, which handles them in the order they were received.
         """
-        content = None
-        filename = None
-        try:
-            decrypted = self.decrypt_message(peer_id, msg)
-        except Exception as e:
-            print(f"Failed to decrypt message from {peer_id}: {e}")
-            return
+        pending = self.inbox.get(peer_id)
+        if pending is None:
+            pending = self.inbox[peer_id] = []
+            asyncio.create_task(self.open_messages(peer_id, pending))
+        pending.append(msg)
+
+    async def open_messages(self, peer_id, pending):
+        """
+        Decrypt the messages queued for a peer until none is left.
 
+        Args:
+            peer_id (str): The sending peer.
+            pending (list): Its queue in self.inbox, filled by handle_message meanwhile.
+        """
+        loop = asyncio.get_running_loop()
         try:
-            data = json.loads(decrypted)
-        except json.JSONDecodeError:
-            print(f"Invalid JSON message from {peer_id}")
-            return
+            while pending:
+                batch = pending[:BATCH]
+                del pending[:BATCH]
+                session = self.crypto.get(peer_id)
+                if session is None:
+                    print(f"Dropped {len(batch)} messages from {peer_id}: no key yet")
+                    continue
+                for opened in await loop.run_in_executor(CRYPTO_POOL, session.open_batch, batch):
+                    final = self.add_chunk(peer_id, opened)
+                    if final is None:
+                        continue
+                    try:
+                        await self.deliver(peer_id, final)
+                    except Exception:
+                        # one bad message must not stop the messages queued behind it
+                        final.discard()
+                        logging.exception("Failed to handle a message from %s", peer_id)
+        finally:
+            if self.inbox.get(peer_id) is pending:
+                del self.inbox[peer_id]
+
+    def add_chunk(self, peer_id, opened):
+        """
+        Add an opened message to the message it belongs to.
 
-        msg_id = data.get("msg_id")
-        chunk_total = int(data.get("chunk_total", 1))
-
-        # If a msg_id is present we treat it as chunked (even if chunk_total == 1).
-        if msg_id:
-            # Ensure buffer structures exist
-            if peer_id not in self.chunk_buffers:
-                self.chunk_buffers[peer_id] = {}
-            if msg_id not in self.chunk_buffers[peer_id]:
-                self.chunk_buffers[peer_id][msg_id] = []
-
-            # Avoid storing exact duplicate chunk objects (same index + content)
-            incoming_index = data.get("chunk_index", 0)
-            existing = self.chunk_buffers[peer_id][msg_id]
-            duplicate = False
-            for ex in existing:
-                if ex.get("chunk_index") == incoming_index and ex.get("content") == data.get("content"):
-                    duplicate = True
-                    break
-            if not duplicate:
-                existing.append(data)
-
-            # If we haven't got all pieces yet, wait
-            if len({c.get("chunk_index") for c in self.chunk_buffers[peer_id][msg_id]}) < chunk_total:
-                return
+        Args:
+            peer_id (str): The sending peer.
+            opened: What CryptoSession.open returned for it, or the ValueError it raised.
 
-            # All chunks present -> reconstruct (reconstructor will clean up buffer)
-            reconstructed = self._reconstruct_chunks(peer_id, msg_id)
-            if reconstructed is None:
-                print(f"Failed to reconstruct message from {peer_id} msg_id {msg_id}")
-                return
-            final = reconstructed
-        else:
+        Returns:
+            Reassembly: The message once complete, None before or if the chunk was dropped.
+        """
+        try:
+            if isinstance(opened, ValueError):
+                raise opened
+            if isinstance(opened, framing.Frame):
+                return self.reassembler.add_frame(peer_id, opened)
+            if not isinstance(opened, dict):
+                raise ValueError("not a JSON object")
+            # If a msg_id is present we treat it as chunked (even if chunk_total == 1).
+            if opened.get("msg_id"):
+                return self.reassembler.add(peer_id, opened)
             # No msg_id -- treat as a single, self-contained message (content is base64)
-            final = data
+            final = Reassembly(opened.get("type", "text"), 1, opened.get("name"))
+            final.add(0, opened.get("content", ""))
+            return final
+        except (TypeError, ValueError) as e:
+            print(f"Dropped message from {peer_id}: {e}")
+            return None
 
-        # Now decode the base64 content (reconstructor returned base64 string)
-        b64_content = final.get("content", "")
-        try:
-            raw_bytes = base64.b64decode(b64_content)
-        except Exception as e:
-            print(f"Failed to base64-decode content from {peer_id}: {e}")
-            return
+    async def deliver(self, peer_id, final):
+        """
+        Show or save a complete message, and relay it to the other peers if hosting.
 
-        msg_type = final.get("type", "text")
+        Args:
+            peer_id (str): The sending peer.
+            final (Reassembly): The complete message, saved or discarded here.
+        """
+        content = None
+        filename = None
+        filepath = None
+        msg_type = final.msg_type
         if msg_type == "text":
             try:
-                content = raw_bytes
+                content = final.content()
+            except (OSError, ValueError) as e:
+                print(f"Failed to read message from {peer_id}: {e}")
+                return
+            finally:
+                final.discard()  # removes the temporary file of a spilled message
+            try:
                 print(content.decode("utf-8"))
             except Exception as e:
                 # If decoding fails, show a hex preview instead of crashing
-                print(f"(text decode error) raw bytes from {peer_id}: {raw_bytes[:64].hex()}... ({e})")
+                print(f"(text decode error) raw bytes from {peer_id}: {content[:64].hex()}... ({e})")
                 return
         elif msg_type == "file":
-            content = raw_bytes
-            filename = final.get("name", "unknown")
+            filename = final.name or "unknown"
             try:
-                filepath = get_file_path(filename, raw_bytes)
+                filepath = download_path(filename)
+                # Writing a message kept in memory can take a while, keep it off the loop
+                await asyncio.get_running_loop().run_in_executor(None, final.save, filepath)
                 print('file:///' + filepath.replace("\\", "/"))
             except Exception as e:
+                final.discard()
                 print(f"Failed to save file from {peer_id}: {e}")
+                return
         else:
+            final.discard()
             print(f"Unknown message type from {peer_id}: {msg_type}")
 
         # Relay unchanged original encrypted message if host
@@ -511,7 +739,10 @@ class ChatClient:
             for other_id, ch in self.channels.items():
                 if other_id != peer_id:
                     try:
-                        asyncio.create_task(self.send_message(msg_type, content, filename))
+                        if filepath:
+                            asyncio.create_task(self.send_file(filepath))
+                        else:
+                            asyncio.create_task(self.send_message(msg_type, content, filename))
                     except Exception as e:
                         print(f"Failed to relay message to {other_id}: {e}")
 
@@ -525,6 +756,51 @@ class ChatClient:
         await self.join_room()
         await self.listen_server()
 
+    def peer_alive(self, peer_id):
+        """
+        Whether the connection with a peer exists and has not failed or closed.
+
+        Args:
+            peer_id (str): ID of the peer.
+
+        Returns:
+            bool: True if the connection can be kept.
+        """
+        pc = self.peers.get(peer_id)
+        return pc is not None and pc.connectionState not in ("failed", "closed")
+
+    async def drop_peer(self, peer_id):
+        """
+        Close the connection with a peer and forget its channel, ciphers and
+        partial messages. Nothing is left to handle for it once this returns.
+
+        Args:
+            peer_id (str): ID of the peer.
+        """
+        pc = self.peers.pop(peer_id, None)
+        self.channels.pop(peer_id, None)
+        self.send_windows.pop(peer_id, None)
+        self.crypto.pop(peer_id, None)
+        self.inbox.pop(peer_id, None)
+        self.ice_outbox.pop(peer_id, None)
+        self.reassembler.drop_peer(peer_id)
+        if pc is not None:
+            await pc.close()
+
+    async def reconnect_peer(self, peer_id):
+        """
+        Replace a failed connection with a peer: the host offers a new one if the
+        peer is still in the room, a client gets ready for that offer.
+
+        Args:
+            peer_id (str): ID of the peer.
+        """
+        await self.drop_peer(peer_id)
+        if not self.ishost:
+            await self.setup_client_peer(peer_id)
+        elif peer_id in self.peer_features:
+            await self.setup_host_peer(peer_id)
+
     async def setup_host_peer(self, peer_id):
         """
         Set up a new peer connection when hosting.
@@ -539,16 +815,20 @@ class ChatClient:
         self.peers[peer_id] = pc
         channel = pc.createDataChannel("chat")
         self.channels[peer_id] = channel
+        self.send_windows[peer_id] = self.send_window(channel)
         self.add_media_tracks(pc, peer_id)
 
         @pc.on("connectionstatechange")
         def on_connection_state():
             logging.info(f"Connection state: {pc.connectionState}")
+            if pc.connectionState in ("failed", "closed") and self.peers.get(peer_id) is pc:
+                asyncio.create_task(self.reconnect_peer(peer_id))
 
         @pc.on("icecandidate")
         def on_icecandidate(candidate):
             if candidate:
                 logging.info(f"Discovered candidate: {candidate}")
+                self.queue_ice_candidate(peer_id, candidate)
 
         @pc.on("datachannel")
         def on_datachannel(channel):
@@ -570,15 +850,16 @@ class ChatClient:
 
         offer = await pc.createOffer()
         await pc.setLocalDescription(offer)
-        await self.ws.send(json.dumps({
+        await self.send_signal({
             "type": "offer",
             "room": self.room,
             "from": self.name,
             "to": peer_id,
-            "sdp": pc.localDescription.sdp,
+            **self.sdp_fields(peer_id, pc.localDescription.sdp),
             "sdpType": pc.localDescription.type,
-            "pubKey": serialize_public_key(self.rsapub).decode("ascii")
-        }))
+            "pubKey": serialize_public_key(self.rsapub).decode("ascii"),
+            "frames": list(framing.FRAMES)  # binary frame formats we accept, see framing.py
+        })
 
     async def setup_client_peer(self, host_id):
         """
@@ -592,14 +873,23 @@ class ChatClient:
         self.peers[host_id] = pc
         channel = pc.createDataChannel("chat")
         self.channels[host_id] = channel
+        self.send_windows[host_id] = self.send_window(channel)
         key = Fernet.generate_key()
-        self.keys[host_id] = key
+        self.crypto[host_id] = CryptoSession(key)
         self.add_media_tracks(pc, host_id)
 
         @channel.on("open")
         def on_open():
-            asyncio.create_task(self.async_input_loop())
+            if not self.channel_open:
+                asyncio.create_task(self.async_input_loop())
             asyncio.create_task(self.send_message('text', f"{self.name} joined the room".encode("utf-8")))
+            self.channel_open = True
+
+        @pc.on("connectionstatechange")
+        def on_connection_state():
+            logging.info(f"Connection state with host: {pc.connectionState}")
+            if pc.connectionState in ("failed", "closed") and self.peers.get(host_id) is pc:
+                asyncio.create_task(self.reconnect_peer(host_id))
 
         @pc.on("datachannel")
         def on_datachannel(channel):
@@ -607,10 +897,124 @@ class ChatClient:
             def on_message(msg):
                 self.handle_message(host_id, msg)
 
+        @pc.on("icecandidate")
+        def on_icecandidate(candidate):
+            if candidate:
+                self.queue_ice_candidate(host_id, candidate)
+
         @pc.on("iceconnectionstatechange")
         def on_ice_state():
             logging.info(f"ICE state with host: {pc.iceConnectionState}")
 
+    def queue_ice_candidate(self, peer_id, candidate):
+        """
+        Queue a local ICE candidate for a peer. Candidates gathered within
+        ICE_BATCH_WINDOW are sent together in a single ice-batch frame.
+
+        aiortc gathers every candidate before the offer or answer is created and
+        puts them in the SDP, it never emits "icecandidate". This only runs with
+        a peer connection that trickles candidates; the ice-batch frames this
+        client receives come from trickling peers such as browsers.
+
+        Args:
+            peer_id (str): ID of the peer the candidate is for.
+            candidate (RTCIceCandidate): The local candidate.
+        """
+        pending = self.ice_outbox.setdefault(peer_id, [])
+        pending.append({
+            "candidate": "candidate:" + candidate_to_sdp(candidate),
+            "sdpMid": candidate.sdpMid,
+            "sdpMLineIndex": candidate.sdpMLineIndex
+        })
+        if len(pending) == 1:
+            asyncio.get_running_loop().call_later(
+                ICE_BATCH_WINDOW, lambda: asyncio.create_task(self.flush_ice_candidates(peer_id))
+            )
+
+    async def flush_ice_candidates(self, peer_id):
+        """
+        Send the queued local ICE candidates for a peer as one ice-batch frame.
+
+        Args:
+            peer_id (str): ID of the peer the candidates are for.
+        """
+        candidates = self.ice_outbox.pop(peer_id, None)
+        if candidates:
+            await self.send_signal({
+                "type": "ice-batch",
+                "room": self.room,
+                "from": self.name,
+                "to": peer_id,
+                "candidates": candidates
+            })
+
+    def sdp_fields(self, peer_id, sdp):
+        """
+        Build the SDP member of an offer or answer, compressed with the shared
+        dictionary when the peer advertised support for it.
+
+        Args:
+            peer_id (str): ID of the peer the SDP is for.
+            sdp (str): The local SDP.
+
+        Returns:
+            dict: Either {"sdpz": ...} or {"sdp": ...}.
+        """
+        if sdpz.SDPZ in self.peer_features.get(peer_id, ()):
+            return {"sdpz": sdpz.compress(sdp)}
+        return {"sdp": sdp}
+
+    def read_sdp(self, data):
+        """
+        Get the SDP of an offer or answer, inflating it if it was compressed.
+
+        Args:
+            data (dict): The offer or answer message.
+
+        Returns:
+            str: The SDP text.
+        """
+        if "sdpz" in data:
+            return sdpz.decompress(data["sdpz"])
+        return data["sdp"]
+
+    async def add_ice_candidates(self, peer_id, data):
+        """
+        Add the remote ICE candidates of an ice or ice-batch frame to the peer connection.
+
+        Args:
+            peer_id (str): ID of the peer that sent the candidates.
+            data (dict): The ice or ice-batch message.
+        """
+        pc = self.peers.get(peer_id)
+        if not pc:
+            logging.warning(f"No PC found for {peer_id}")
+            return
+
+        candidates = data.get("candidates") if data["type"] == "ice-batch" else [data.get("candidate")]
+        if not isinstance(candidates, list):
+            logging.warning("Ignoring an ice-batch from %s without a candidate list", peer_id)
+            return
+        for c in candidates:
+            if not c or (isinstance(c, dict) and not c.get("candidate")):
+                continue  # end of candidates
+            # Any member can send these, a malformed candidate is skipped rather than ending listen_server
+            try:
+                if (not isinstance(c, dict) or not isinstance(c["candidate"], str)
+                        or not isinstance(c.get("sdpMid"), (str, type(None)))
+                        or not isinstance(c.get("sdpMLineIndex"), (int, type(None)))):
+                    raise ValueError("unexpected candidate fields")
+                _, colon, line = c["candidate"].partition(":")
+                if not colon:
+                    raise ValueError("no candidate: prefix")
+                candidate = candidate_from_sdp(line)
+            except (AssertionError, IndexError, ValueError) as e:
+                logging.warning("Ignoring a malformed ICE candidate from %s: %r", peer_id, e)
+                continue
+            candidate.sdpMid = c.get("sdpMid")
+            candidate.sdpMLineIndex = c.get("sdpMLineIndex")
+            await pc.addIceCandidate(candidate)
+
     def add_media_tracks(self, pc, peer_id):
         video_track = media.VideoChannelTrack()
         audio_track = media.AudioChannelTrack()
@@ -634,13 +1038,13 @@ class ChatClient:
 
         t = data["type"]
         if t == "offer":
-            offer_desc = RTCSessionDescription(sdp=data["sdp"], type=data["sdpType"])
+            offer_desc = RTCSessionDescription(sdp=self.read_sdp(data), type=data["sdpType"])
             peer_pubkey_bytes = data["pubKey"].encode("ascii")
             peer_rsapub = serialization.load_pem_public_key(peer_pubkey_bytes)
 
             # Encrypt the Fernet key with the peer's RSA public key
             encrypted_key = peer_rsapub.encrypt(
-                self.keys[peer_id],
+                self.crypto[peer_id].key,
                 padding.OAEP(
                     mgf=padding.MGF1(algorithm=hashes.SHA256()),
                     algorithm=hashes.SHA256(),
@@ -651,20 +1055,26 @@ class ChatClient:
             # Base64 encode to send via JSON/WebSocket
             encrypted_key_b64 = base64.b64encode(encrypted_key).decode("ascii")
 
+            # Switch to binary frames if the peer offered a format we speak too
+            frames = framing.pick(data.get("frames"))
+            if frames:
+                self.crypto[peer_id].use_frames()
+
             await pc.setRemoteDescription(offer_desc)
             answer = await pc.createAnswer()
             await pc.setLocalDescription(answer)
-            await self.ws.send(json.dumps({
+            await self.send_signal({
                 "type": "answer",
                 "room": self.room,
                 "from": self.name,
                 "to": peer_id,
-                "sdp": pc.localDescription.sdp,
+                **self.sdp_fields(peer_id, pc.localDescription.sdp),
                 "sdpType": pc.localDescription.type,
-                "fernetKey": encrypted_key_b64
-            }))
+                "fernetKey": encrypted_key_b64,
+                **({"frames": frames} if frames else {})
+            })
         elif t == "answer":
-            answer_desc = RTCSessionDescription(sdp=data["sdp"], type=data["sdpType"])
+            answer_desc = RTCSessionDescription(sdp=self.read_sdp(data), type=data["sdpType"])
             encrypted_key_bytes = base64.b64decode(data["fernetKey"])
             fernet_key = self.rsapriv.decrypt(
                 encrypted_key_bytes,
@@ -675,8 +1085,10 @@ class ChatClient:
                 )
             )
 
-            # Create a Fernet key for this peer
-            self.keys[peer_id] = fernet_key
+            # Ciphers shared with this peer, see cryptosession.py
+            self.crypto[peer_id] = CryptoSession(fernet_key)
+            if data.get("frames") in framing.FRAMES:
+                self.crypto[peer_id].use_frames()
             await pc.setRemoteDescription(answer_desc)
 
 
@@ -0,0 +1,75 @@
+"""
+SDP dictionary compression for offer/answer messages.
+
+SDP bodies are a few KB of text built from the same handful of lines, so
+deflate primed with a dictionary of those lines shrinks them far more than
+deflate alone. A peer that advertises the "sdpz" feature on join accepts
+an "sdpz" field (base64 of the compressed SDP) in place of "sdp".
+The dictionary is part of the protocol: changing it needs a new feature name.
+"""
+import base64
+import zlib
+
+SDPZ = "sdpz"
+MAX_SDP_SIZE = 256 * 1024  # refuse to inflate anything larger
+
+# Lines every SDP shares, the most frequent last since deflate prefers close matches
+ZDICT = (
+    "a=fmtp:99 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f\r\n"
+    "a=rtpmap:99 H264/90000\r\na=rtpmap:98 rtx/90000\r\na=fmtp:98 apt=97\r\n"
+    "a=rtpmap:0 PCMU/8000\r\na=rtpmap:8 PCMA/8000\r\n"
+    "m=application 9 DTLS/SCTP 5000\r\na=sctpmap:5000 webrtc-datachannel 65535\r\n"
+    "a=max-message-size:65536\r\n"
+    "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time\r\n"
+    "a=extmap:1 urn:ietf:params:rtp-hdrext:sdes:mid\r\n"
+    "v=0\r\no=- 3900000000 3900000000 IN IP4 0.0.0.0\r\ns=-\r\nt=0 0\r\n"
+    "a=group:BUNDLE 0 1 2\r\na=msid-semantic:WMS *\r\n"
+    "m=audio 9 UDP/TLS/RTP/SAVPF 111 0 8\r\na=rtpmap:111 opus/48000/2\r\n"
+    "m=video 9 UDP/TLS/RTP/SAVPF 97 98 99 100 101 102\r\na=rtpmap:97 VP8/90000\r\n"
+    "a=rtcp-fb:97 nack\r\na=rtcp-fb:97 nack pli\r\na=rtcp-fb:97 goog-remb\r\n"
+    "c=IN IP4 0.0.0.0\r\na=rtcp:9 IN IP4 0.0.0.0\r\na=rtcp-mux\r\na=sendrecv\r\n"
+    "a=ssrc-group:FID \r\na=ssrc: cname:\r\na=msid:\r\na=mid:0\r\na=mid:1\r\na=mid:2\r\n"
+    "a=end-of-candidates\r\na=ice-ufrag:\r\na=ice-pwd:\r\na=setup:actpass\r\na=setup:active\r\n"
+    "a=fingerprint:sha-256 \r\n"
+    "typ srflx raddr 0.0.0.0 rport \r\n"
+    "a=candidate: 1 udp 1694498815 typ srflx raddr rport\r\n"
+    "a=candidate: 1 udp 2130706431 192.168. typ host\r\n"
+).encode("ascii")
+
+
+def compress(sdp):
+    """
+    Compress an SDP body with the shared dictionary.
+
+    Args:
+        sdp (str): The SDP text.
+
+    Returns:
+        str: Base64 of the raw deflate stream, ready to be sent as "sdpz".
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+    data = compressor.compress(sdp.encode("utf-8")) + compressor.flush()
+    return base64.b64encode(data).decode("ascii")
+
+
+def decompress(sdpz):
+    """
+    Inflate an "sdpz" field back into SDP text.
+
+    Args:
+        sdpz (str): Base64 of the compressed SDP.
+
+    Returns:
+        str: The SDP text.
+
+    Raises:
+        ValueError: If the data is invalid or inflates beyond MAX_SDP_SIZE.
+    """
+    try:
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+        data = decompressor.decompress(base64.b64decode(sdpz, validate=True), MAX_SDP_SIZE)
+    except (zlib.error, ValueError) as e:
+        raise ValueError(f"Invalid sdpz payload: {e}")
+    if decompressor.unconsumed_tail:
+        raise ValueError("sdpz payload too large")
+    return data.decode("utf-8")
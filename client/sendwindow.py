@@ -0,0 +1,61 @@
+"""
+Flow control of data channel sends.
+
+RTCDataChannel.send never blocks: whatever is sent waits in the SCTP buffer
+until the network takes it. A SendWindow lets a sender queue at most `window`
+bytes on a channel. Past that it waits for the channel's bufferedamountlow
+event, raised when the buffer drains to `low` bytes, instead of polling
+bufferedAmount. The sender then has window - low bytes of credit before it
+waits again, and the channel still has `low` bytes queued to send meanwhile,
+so the link stays busy.
+"""
+import asyncio
+
+SEND_WINDOW = 1 << 20  # bytes queued on a data channel before sending waits
+SEND_LOW_WATER = 256 * 1024  # sending resumes once the queue drains to this
+
+
+class SendWindow:
+    """
+    The send window of one data channel.
+
+    Args:
+        channel (RTCDataChannel): The channel messages are sent on.
+        window (int): Bytes that may be queued on it.
+        low (int): Queued bytes at which waiting senders resume, below window.
+    """
+
+    def __init__(self, channel, window=SEND_WINDOW, low=SEND_LOW_WATER):
+        if not 0 <= low < window:
+            raise ValueError(f"the low water mark ({low}) must be below the send window ({window})")
+        self.channel = channel
+        self.window = window
+        self.drained = asyncio.Event()
+        channel.bufferedAmountLowThreshold = low
+        channel.on("bufferedamountlow", self.drained.set)
+        channel.on("close", self.drained.set)  # wake the senders, sending fails from now on
+
+    async def wait(self):
+        """
+        Wait until the channel has room for another message, or is not open.
+        """
+        channel = self.channel
+        while channel.bufferedAmount > self.window and channel.readyState == "open":
+            self.drained.clear()
+            await self.drained.wait()
+
+    async def send(self, message):
+        """
+        Send a message once the window has room for it.
+
+        Args:
+            message (bytes | str): The message.
+
+        Returns:
+            bool: False if the channel is not open, the message was not sent.
+        """
+        await self.wait()
+        if self.channel.readyState != "open":
+            return False
+        self.channel.send(message)
+        return True
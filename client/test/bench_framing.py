@@ -0,0 +1,101 @@
+# bench_framing.py
+# Throughput of the two data channel paths for a file transfer, per side:
+#
+#   fernet  chunk base64-encoded into JSON, Fernet-encrypted, sent as a string
+#   frames  chunk sent raw in a binary frame sealed with AES-256-GCM (framing.py)
+#
+#   python client/test/bench_framing.py --size 64
+#
+# The sender encodes and encrypts every chunk as ChatClient.send_chunks does, the
+# receiver decrypts and decodes them into a Reassembly as handle_message does.
+# No network: only CPU and the bytes that would go on the wire are measured.
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cryptography.fernet import Fernet
+import framing
+from reassembly import RAW_CHUNK_SIZE, Reassembler
+
+
+def chunks_of(data):
+    view = memoryview(data)
+    return [view[i:i + RAW_CHUNK_SIZE] for i in range(0, len(view), RAW_CHUNK_SIZE)]
+
+
+def send_fernet(key, chunks):
+    fernet = Fernet(key)
+    msg_id = str(uuid.uuid4())
+    out = []
+    for i, chunk in enumerate(chunks):
+        payload = json.dumps({
+            "type": "file",
+            "msg_id": msg_id,
+            "chunk_index": i,
+            "chunk_total": len(chunks),
+            "content": base64.b64encode(chunk).decode("ascii"),
+            "name": "bench.bin"
+        })
+        out.append(fernet.encrypt(payload.encode()).decode("ascii"))
+    return out
+
+
+def receive_fernet(key, messages):
+    fernet = Fernet(key)
+    reassembler = Reassembler()
+    for msg in messages:
+        data = json.loads(fernet.decrypt(msg.encode("ascii")).decode("utf-8"))
+        final = reassembler.add("peer", data)
+    return final
+
+
+def send_frames(key, chunks):
+    cipher = framing.FrameCipher(key)
+    msg_id = uuid.uuid4().bytes
+    return [
+        cipher.seal("file", msg_id, i, len(chunks), chunk, "bench.bin" if i == 0 else None)
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def receive_frames(key, messages):
+    cipher = framing.FrameCipher(key)
+    reassembler = Reassembler()
+    for msg in messages:
+        final = reassembler.add_frame("peer", cipher.open(msg))
+    return final
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data channel framing throughput")
+    parser.add_argument("--size", type=int, default=64, help="MB sent per path")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    chunks = chunks_of(data)
+    key = Fernet.generate_key()
+    print(f"{args.size} MB in {len(chunks)} chunks of {RAW_CHUNK_SIZE} bytes")
+    print(f"{'path':>8}{'send MB/s':>12}{'recv MB/s':>12}{'wire MB':>10}{'overhead':>10}")
+    for name, send, receive in (("fernet", send_fernet, receive_fernet), ("frames", send_frames, receive_frames)):
+        start = time.perf_counter()
+        messages = send(key, chunks)
+        sent = time.perf_counter() - start
+        start = time.perf_counter()
+        final = receive(key, messages)
+        received = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as tmp:
+            final.save(os.path.join(tmp, "bench.bin"))
+            with open(os.path.join(tmp, "bench.bin"), "rb") as f:
+                assert f.read() == data
+        wire = sum(len(m) for m in messages)
+        print(f"{name:>8}{args.size / sent:>12.0f}{args.size / received:>12.0f}{wire / 2 ** 20:>10.1f}{wire / len(data):>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
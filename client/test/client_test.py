@@ -49,6 +49,27 @@ except Exception as e:
 def generate_session_code(length=6):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
+# --- Room events (server-sent events, no polling) ---
+def wait_for_peer(url, roomcode, username):
+    """Block until another user joins the room. Returns False if the room closes first."""
+    with requests.get(url + f"/room/{roomcode}/events", stream=True, timeout=(10, None)) as r:
+        if r.status_code != 200:
+            print(json.dumps({"error": f"Subscribe failed: {r.text}"}))
+            sys.exit(1)
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "members" and any(u["username"] != username for u in data["users"]):
+                    return True
+                if event == "join" and data["username"] != username:
+                    return True
+                if event == "closed":
+                    return False
+    return False
+
 # --- Signaling Client (HTTP only, no GUI) ---
 def signaling_client(cmd, roomcode, url, username):
     global my_port, peer_ip, peer_port
@@ -65,22 +86,20 @@ def signaling_client(cmd, roomcode, url, username):
         my_port = r.json()["status"].split(" ")[2].split(":")[1]
         print(json.dumps({"status": f"Room {roomcode} created", "my_port": my_port}))
         
-        # Wait for peer
-        while True:
-            time.sleep(2)
-            rr = requests.get(url + "/rooms")
-            rooms = rr.json()
-            if roomcode in rooms and len(rooms[roomcode]["peers"]) >= 2:
-                rr2 = requests.get(
-                    url + "/room/join",
-                    params={"room_code": roomcode, "username": username, "peer_ip": my_ip}
-                )
-                data = rr2.json()
-                for uname, addr in data["peers"].items():
-                    if uname != username:
-                        peer_ip, peer_port = addr.split(":")
-                        peer_port = int(peer_port)
-                        return udp_start()
+        # Wait for peer: the server pushes membership changes of the room
+        if not wait_for_peer(url, roomcode, username):
+            print(json.dumps({"error": f"Room {roomcode} closed before a peer joined."}))
+            sys.exit(1)
+        rr2 = requests.get(
+            url + "/room/join",
+            params={"room_code": roomcode, "username": username, "peer_ip": my_ip}
+        )
+        data = rr2.json()
+        for uname, addr in data["peers"].items():
+            if uname != username:
+                peer_ip, peer_port = addr.split(":")
+                peer_port = int(peer_port)
+                return udp_start()
 
     elif cmd.upper() == "JOIN":
         r = requests.get(
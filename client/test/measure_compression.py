@@ -0,0 +1,147 @@
+# measure_compression.py
+# Bytes on the wire and CPU time per join for the signaling traffic of one guest:
+# join, joined, gotjoined, then offer and answer carrying SDP, the PEM public key
+# and the wrapped Fernet key, each sent to the server and relayed to the peer.
+#
+#   python client/test/measure_compression.py
+#
+# permessage-deflate is emulated with zlib exactly as websockets and aiohttp run it:
+# raw deflate, one compressor per direction and connection kept across messages,
+# and a sync flush whose 4 byte tail is stripped from every message.
+import base64
+import json
+import os
+import random
+import string
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sdpz
+
+REPEAT = 300
+
+
+def random_token(n, alphabet=string.ascii_letters + string.digits):
+    return "".join(random.choice(alphabet) for _ in range(n))
+
+
+def make_sdp(kind):
+    """An SDP shaped like the ones aiortc produces for audio, video and a data channel."""
+    ufrag, pwd = random_token(4), random_token(22)
+    fingerprint = ":".join(f"{random.randrange(256):02X}" for _ in range(32))
+    setup = "actpass" if kind == "offer" else "active"
+    session = random.randrange(10 ** 9, 4 * 10 ** 9)
+    candidates = "".join(
+        f"a=candidate:{random_token(32, 'abcdef0123456789')} 1 udp 2130706431 192.168.1.{10 + i} {50000 + i} typ host\r\n"
+        for i in range(3)
+    ) + f"a=candidate:{random_token(32, 'abcdef0123456789')} 1 udp 1694498815 84.12.7.1 50000 typ srflx raddr 192.168.1.10 rport 50000\r\n"
+    transport = (
+        "c=IN IP4 192.168.1.10\r\na=rtcp:9 IN IP4 0.0.0.0\r\na=rtcp-mux\r\n" + candidates +
+        f"a=end-of-candidates\r\na=ice-ufrag:{ufrag}\r\na=ice-pwd:{pwd}\r\n"
+        f"a=fingerprint:sha-256 {fingerprint}\r\na=setup:{setup}\r\n"
+    )
+    ssrc, rtx, cname = random.randrange(2 ** 32), random.randrange(2 ** 32), random_token(36)
+    msid = f"{random_token(36)} {random_token(36)}"
+    return (
+        f"v=0\r\no=- {session} {session} IN IP4 0.0.0.0\r\ns=-\r\nt=0 0\r\n"
+        "a=group:BUNDLE 0 1 2\r\na=msid-semantic:WMS *\r\n"
+        "m=video 9 UDP/TLS/RTP/SAVPF 97 98 99 100\r\n" + transport +
+        "a=sendrecv\r\na=extmap:1 urn:ietf:params:rtp-hdrext:sdes:mid\r\n"
+        "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time\r\na=mid:0\r\n"
+        f"a=msid:{msid}\r\na=ssrc-group:FID {ssrc} {rtx}\r\na=ssrc:{ssrc} cname:{cname}\r\na=ssrc:{rtx} cname:{cname}\r\n"
+        "a=rtpmap:97 VP8/90000\r\na=rtcp-fb:97 nack\r\na=rtcp-fb:97 nack pli\r\na=rtcp-fb:97 goog-remb\r\n"
+        "a=rtpmap:98 rtx/90000\r\na=fmtp:98 apt=97\r\na=rtpmap:99 H264/90000\r\n"
+        "a=fmtp:99 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f\r\n"
+        "a=rtpmap:100 rtx/90000\r\na=fmtp:100 apt=99\r\n"
+        "m=audio 9 UDP/TLS/RTP/SAVPF 111 0 8\r\n" + transport +
+        f"a=sendrecv\r\na=extmap:1 urn:ietf:params:rtp-hdrext:sdes:mid\r\na=mid:1\r\na=msid:{msid}\r\n"
+        f"a=ssrc:{random.randrange(2 ** 32)} cname:{cname}\r\n"
+        "a=rtpmap:111 opus/48000/2\r\na=rtpmap:0 PCMU/8000\r\na=rtpmap:8 PCMA/8000\r\n"
+        "m=application 9 DTLS/SCTP 5000\r\n" + transport +
+        "a=mid:2\r\na=sctpmap:5000 webrtc-datachannel 65535\r\na=max-message-size:65536\r\n"
+    )
+
+
+def join_messages(compress_sdp):
+    """The (sent, relayed) signaling messages of one join, as the client builds them."""
+    pubkey = "-----BEGIN PUBLIC KEY-----\n" + "\n".join(
+        base64.b64encode(os.urandom(48)).decode() for _ in range(6)
+    ) + "\n-----END PUBLIC KEY-----\n"
+    fernet_key = base64.b64encode(os.urandom(256)).decode()
+
+    def sdp_fields(sdp):
+        return {"sdpz": sdpz.compress(sdp)} if compress_sdp else {"sdp": sdp}
+
+    offer = {"type": "offer", "room": "ROOM01", "from": "host", "to": "guest",
+             **sdp_fields(make_sdp("offer")), "sdpType": "offer", "pubKey": pubkey}
+    answer = {"type": "answer", "room": "ROOM01", "from": "guest", "to": "host",
+              **sdp_fields(make_sdp("answer")), "sdpType": "answer", "fernetKey": fernet_key}
+    sender = {"from_ip": "10.0.0.1", "from_user": "host"}
+    return [
+        ({"type": "join", "room": "ROOM01", "from": "guest", "password": "", "create": False,
+          "features": ["ice-batch", "sdpz"]}, None),
+        (None, {"type": "joined", "room": "ROOM01", "user": "host",
+                "clients": [{"username": "host", "ip": "10.0.0.1", "features": ["ice-batch", "sdpz"]}]}),
+        (None, {"type": "gotjoined", "room": "ROOM01",
+                "user": {"username": "guest", "ip": "10.0.0.2", "features": ["ice-batch", "sdpz"]}}),
+        (offer, dict(offer, **sender)),
+        (answer, dict(answer, **sender)),
+    ]
+
+
+class Deflate:
+    """One direction of a permessage-deflate connection with context takeover."""
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+
+    def send(self, data):
+        payload = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        payload = payload[:-4]
+        assert self.decompressor.decompress(payload + b"\x00\x00\xff\xff") == data
+        return len(payload)
+
+
+def measure(deflate, compress_sdp):
+    """Returns (bytes on the wire, CPU seconds) per join, averaged over REPEAT joins."""
+    total_bytes = 0
+    cpu = 0.0
+    for _ in range(REPEAT):
+        start = time.process_time()
+        messages = join_messages(compress_sdp)
+        # client -> server and server -> client, each a separate websocket
+        upstream, downstream = Deflate(), Deflate()
+        for sent, relayed in messages:
+            for stream, message in ((upstream, sent), (downstream, relayed)):
+                if message is None:
+                    continue
+                data = json.dumps(message).encode()
+                total_bytes += stream.send(data) if deflate else len(data)
+            if relayed and "sdpz" in relayed:
+                sdpz.decompress(relayed["sdpz"])
+        cpu += time.process_time() - start
+    return total_bytes / REPEAT, cpu / REPEAT
+
+
+def main():
+    random.seed(1)
+    baseline_cpu = None
+    print(f"{'mode':<28}{'bytes/join':>12}{'CPU us/join':>14}")
+    for name, deflate, compress_sdp in (
+        ("plain", False, False),
+        ("permessage-deflate", True, False),
+        ("sdpz", False, True),
+        ("sdpz + permessage-deflate", True, True),
+    ):
+        size, cpu = measure(deflate, compress_sdp)
+        if baseline_cpu is None:
+            baseline_cpu = cpu
+        print(f"{name:<28}{size:>12.0f}{(cpu - baseline_cpu) * 1e6:>14.0f}")
+    print("CPU is the extra time over plain, spent compressing and inflating")
+
+
+if __name__ == "__main__":
+    main()
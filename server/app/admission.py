@@ -0,0 +1,78 @@
+import asyncio
+import random
+from collections import deque
+
+## Admission control for websockets. At most max_active connections are served
+## at once, the next max_queued wait for a slot in arrival order and anything
+## beyond that, or waiting longer than queue_timeout, is turned away with a
+## Retry-After. After a restart every client reconnects at the same moment;
+## this spreads the joins out instead of letting them all hit the registry together.
+
+class AdmissionRejected(Exception):
+    """
+        Raised by Admission.acquire when the connection is turned away.
+        retry_after is the number of seconds the client should wait.
+    """
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after=retry_after
+
+class Admission:
+    """
+        Counting semaphore with a bounded FIFO queue and a deadline on the wait.
+    """
+    def __init__(self, max_active, max_queued, queue_timeout, retry_after):
+        self.max_active=max_active
+        self.max_queued=max_queued
+        self.queue_timeout=queue_timeout
+        self.retry_after=retry_after
+        self.active=0
+        self._waiters=deque() # futures of the queued connections, oldest first
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _reject(self, message):
+        # spread the retries over [retry_after, 2 * retry_after] so they do not come back together
+        return AdmissionRejected(message, self.retry_after + random.randint(0, self.retry_after))
+
+    async def acquire(self):
+        """
+            Take a slot, waiting in the queue if none is free.
+            Raises AdmissionRejected if the queue is full or the wait times out.
+        """
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queued:
+            raise self._reject("Server busy")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return # release() handed us the slot as the wait timed out (wait_for on 3.12+), keep it
+            raise self._reject("Timed out waiting for a connection slot")
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release() # the slot was handed over just as we gave up
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def release(self):
+        """
+            Give the slot back, straight to the oldest waiter if there is one.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
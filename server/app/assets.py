@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import mimetypes
+import pathlib
+from aiohttp import web
+
+## The landing page and its static files, read once and served from memory.
+## Text assets are compressed at startup, with gzip and with brotli when it is
+## installed, and the smallest variant the client accepts is sent. Every variant
+## has its own ETag so a client revalidating with If-None-Match gets a 304.
+## Files changed on disk are only picked up by a restart.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+ENCODINGS = ("br", "gzip") # preferred first
+
+class StaticAsset:
+    """
+        One file with its compressed variants, {encoding: (body, etag)}; "identity" is the file itself.
+    """
+    __slots__ = ("content_type", "cache_control", "variants")
+
+    def __init__(self, data:bytes, content_type, cache_control):
+        self.content_type=content_type
+        self.cache_control=cache_control
+        digest = hashlib.blake2b(data, digest_size=12).hexdigest()
+        self.variants={"identity": (data, f'"{digest}"')}
+        if content_type.startswith(COMPRESSIBLE):
+            compressed = {"gzip": gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(data, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) < len(data):
+                    self.variants[encoding] = (body, f'"{digest}-{encoding}"')
+
+    def pick(self, accept_encoding) -> str:
+        """
+            The encoding to send for an Accept-Encoding header.
+        """
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.partition(";")
+            params = params.replace(" ", "")
+            if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding in ENCODINGS:
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def response(self, request: web.Request) -> web.Response:
+        encoding = self.pick(request.headers.get("Accept-Encoding", ""))
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        charset = "utf-8" if self.content_type.startswith("text/") else None
+        return web.Response(body=body, content_type=self.content_type, charset=charset, headers=headers)
+
+def etag_matches(if_none_match, etag) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as If-None-Match requires
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+class AssetCache:
+    """
+        Every file of a static directory, by path relative to it.
+    """
+    def __init__(self, root:pathlib.Path, max_age:int):
+        self.assets={}
+        for path in sorted(root.rglob("*")):
+            if path.is_file():
+                self.assets[path.relative_to(root).as_posix()] = load(path, f"public, max-age={max_age}")
+
+    def __len__(self):
+        return len(self.assets)
+
+    def get(self, name) -> StaticAsset:
+        return self.assets.get(name)
+
+def load(path:pathlib.Path, cache_control) -> StaticAsset:
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return StaticAsset(path.read_bytes(), content_type, cache_control)
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from aiohttp import WSCloseCode
+import codec
+import metrics
+import settings
+
+PING = object() # outbox marker for a websocket ping
+CLIENT_TIMEOUT = 4000 # close code of a client that missed a heartbeat or never joined
+
+class Connection:
+    """
+        Connection wraps a websocket with a bounded outbound queue drained by its own writer task.
+        Senders only enqueue, so a slow socket never stalls the read loop of another client.
+        When the queue is full the connection is a slow consumer and is either evicted or
+        the frame is dropped, depending on settings.SLOW_CONSUMER.
+    """
+    def __init__(self, ws, ip, maxsize=None, policy=None, encoding=codec.JSON):
+        self.ws=ws
+        self.ip=ip
+        self.encoding=encoding # codec.JSON in text frames or codec.MSGPACK in binary frames
+        self.features=frozenset() # optional protocol features the client advertised on join
+        self.dropped=0
+        self._queue=asyncio.Queue(maxsize or settings.OUTBOX_SIZE)
+        self._policy=policy or settings.SLOW_CONSUMER
+        self._evicted=False
+        self._writer=None
+        self.timed_out=False # closed by timeout(), the websocket close code says nothing then
+
+    @property
+    def closed(self):
+        return self._evicted or self.ws.closed
+
+    def start(self):
+        self._writer = asyncio.create_task(self._drain())
+
+    def send(self, frame:codec.Frame, received_at=None) -> bool:
+        """
+            Queue a frame in the encoding of this connection. Never blocks.
+            received_at is the perf_counter() time the frame being relayed was received,
+            it feeds the relay latency histogram once the frame is written.
+            Returns False if the frame was not queued.
+        """
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((frame.encode(self.encoding), received_at))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.EVICTIONS.inc(self._policy)
+            if self._policy == "evict":
+                self.evict()
+            return False
+
+    def ping(self):
+        """
+            Queue a websocket ping behind the frames already queued. Never blocks,
+            a ping that does not fit is skipped: the outbox policy deals with the client.
+        """
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait((PING, None))
+        except asyncio.QueueFull:
+            pass
+
+    def timeout(self, reason:bytes):
+        """
+            Close the websocket of a client that went silent. Unlike a normal close
+            this keeps its session resumable.
+        """
+        self.timed_out=True
+        if self._writer:
+            self._writer.cancel()
+        asyncio.create_task(self.ws.close(code=CLIENT_TIMEOUT, message=reason))
+
+    def evict(self):
+        """
+            Close the websocket of a consumer that cannot keep up.
+            The read loop of its own handler then ends and runs the usual cleanup.
+        """
+        if self._evicted:
+            return
+        self._evicted = True
+        logging.warning("Evicting slow consumer %s (%d frames dropped)", self.ip, self.dropped)
+        if self._writer:
+            self._writer.cancel()
+        asyncio.create_task(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"slow consumer"))
+
+    def supersede(self):
+        """
+            Close the websocket of a client that resumed its session on a new connection,
+            e.g. one whose network changed before this one timed out.
+        """
+        if self._writer:
+            self._writer.cancel()
+        asyncio.create_task(self.ws.close(code=WSCloseCode.GOING_AWAY, message=b"session resumed"))
+
+    async def close(self):
+        """
+            Stop the writer task. Frames still queued are discarded.
+        """
+        if self._writer:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    async def _drain(self):
+        while True:
+            data, received_at = await self._queue.get()
+            try:
+                if data is PING:
+                    await self.ws.ping()
+                    continue
+                if isinstance(data, bytes):
+                    await self.ws.send_bytes(data)
+                else:
+                    await self.ws.send_str(data)
+            except ConnectionResetError:
+                return
+            if received_at is not None:
+                metrics.RELAY_LATENCY.observe(time.perf_counter() - received_at)
+
+def broadcast(connections, payload, exclude=None, received_at=None) -> int:
+    """
+        Queue payload on every open connection except exclude, encoding it once per encoding.
+        payload is either a dict or a codec.Frame.
+        Returns the number of connections the frame was queued on.
+    """
+    frame = payload if isinstance(payload, codec.Frame) else codec.Frame(payload)
+    sent = 0
+    for conn in connections:
+        if conn is not exclude and conn.send(frame, received_at):
+            sent += 1
+    return sent
@@ -0,0 +1,446 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from aiohttp import web
+from registry import RoomRegistry, RegistryUnavailable
+from rooms import Rooms
+from user import Users
+from logsetup import setup_logging
+from history import history_of
+import codec
+import settings
+
+## Worker mode: N aiohttp processes share one port through SO_REUSEPORT and a broker
+## process owns the authoritative room directory. Workers talk to the broker over a
+## unix socket with newline delimited JSON. Every worker keeps a mirror of all rooms
+## in which members living on other workers are represented by a RemoteConnection,
+## so websocket_handler relays to them exactly like to a local client.
+
+STREAM_LIMIT = 4 * 1024 * 1024 # same as the default websocket max_msg_size
+RESTART_CHECK = 1 # seconds between two checks that the broker and the workers are running
+
+def _encode(msg) -> bytes:
+    return (json.dumps(msg) + "\n").encode()
+
+class Broker:
+    """
+        Broker owns the shared room directory and forwards frames between workers.
+        Its rooms are plain Rooms objects whose members hold the id of the worker
+        serving them instead of a connection.
+    """
+    def __init__(self, path):
+        self._path=path
+        self._rooms={} # {room_code: Rooms}
+        self._creators={} # {room_code: address charged for the room}
+        self._workers={} # {worker_id: StreamWriter}
+
+    async def serve(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        server = await asyncio.start_unix_server(self._handle, self._path, limit=STREAM_LIMIT)
+        logging.info("Broker listening on %s", self._path)
+        async with server:
+            await server.serve_forever()
+
+    def _send(self, worker, msg):
+        writer = self._workers.get(worker)
+        if writer is not None:
+            writer.write(_encode(msg))
+
+    def _publish(self, msg, origin):
+        data = _encode(msg)
+        for worker, writer in self._workers.items():
+            if worker != origin:
+                writer.write(data)
+
+    async def _handle(self, reader, writer):
+        worker = None
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                op = msg["op"]
+                rid = msg.pop("rid", None)
+                if op == "deliver":
+                    self._send(msg["worker"], msg)
+                elif op == "hello":
+                    worker = msg["worker"]
+                    self._workers[worker] = writer
+                    self._sync(writer)
+                    logging.info("Worker %s connected to broker", worker)
+                elif op == "create":
+                    self._send(worker, {"rid": rid, "ok": self._create(msg, worker)})
+                elif op == "join":
+                    self._send(worker, {"rid": rid, "status": self._join(msg, worker)})
+                elif op == "leave":
+                    self._leave(msg["room"], msg["ip"], worker)
+                elif op == "expire":
+                    self._expire(msg["room"])
+                elif op == "release":
+                    # the worker that issued the resume token drops its member, then answers with released
+                    if msg["worker"] in self._workers:
+                        self._send(msg["worker"], {"op": "release", "token": msg["token"], "worker": worker, "reply": rid})
+                    else:
+                        self._send(worker, {"rid": rid})
+                elif op == "released":
+                    self._send(msg["worker"], {"rid": msg["reply"]})
+                elif op == "record":
+                    room = self._rooms.get(msg["room"])
+                    self._send(worker, {"rid": rid, "message": history_of(room).append(msg["message"]) if room else None})
+                elif op == "history":
+                    room = self._rooms.get(msg["room"])
+                    self._send(worker, {"rid": rid, "history": history_of(room).replay(msg["after"]) if room else None})
+        finally:
+            if worker is not None:
+                self._workers.pop(worker, None)
+                self._drop_worker(worker)
+            writer.close()
+
+    def _sync(self, writer):
+        """
+            Replay the whole directory to a worker that just connected.
+        """
+        for room_code, room in self._rooms.items():
+            owner = room.getownerinfo()
+            writer.write(_encode({
+                "op": "created", "room": room_code, "password": room.getpassword(),
+                "owner": owner.toJSON(), "worker": room.getconnection(owner.getipaddr()),
+                "creator": self._creators.get(room_code)
+            }))
+            for client in room.getotherclients(owner.getipaddr()):
+                writer.write(_encode({
+                    "op": "joined", "room": room_code, "password": room.getpassword(),
+                    "user": client.toJSON(), "worker": room.getconnection(client.getipaddr())
+                }))
+
+    def _create(self, msg, origin) -> bool:
+        room_code = msg["room"]
+        if room_code in self._rooms:
+            return False
+        owner = Users(msg["owner"]["username"], msg["owner"]["ip"], msg["owner"].get("features", ()))
+        room = Rooms(room_code, msg["password"], owner)
+        if msg["worker"] is not None:
+            room.setconnection(owner.getipaddr(), msg["worker"])
+        self._rooms[room_code] = room
+        self._creators[room_code] = msg["creator"]
+        self._publish(dict(msg, op="created"), origin)
+        return True
+
+    def _join(self, msg, origin) -> int:
+        room = self._rooms.get(msg["room"])
+        if room is None:
+            return 0
+        user = Users(msg["user"]["username"], msg["user"]["ip"], msg["user"].get("features", ()))
+        status = room.addclient(user, msg["password"])
+        if status == 1:
+            room.setconnection(user.getipaddr(), origin)
+            self._publish(dict(msg, op="joined", worker=origin), origin)
+        return status
+
+    def _leave(self, room_code, peerip, origin):
+        room = self._rooms.get(room_code)
+        if room is None:
+            return
+        room.dropclient(peerip)
+        if room.getclientnos() == 0:
+            del self._rooms[room_code]
+            self._creators.pop(room_code, None)
+        self._publish({"op": "left", "room": room_code, "ip": peerip}, origin)
+
+    def _expire(self, room_code):
+        """
+            A worker found the room idle. Several workers may ask, and a member may have
+            joined through another worker in the meantime, so check again before deleting.
+        """
+        room = self._rooms.get(room_code)
+        if room is None or room.isonline():
+            return
+        del self._rooms[room_code]
+        self._creators.pop(room_code, None)
+        self._publish({"op": "expired", "room": room_code}, None)
+
+    def _drop_worker(self, worker):
+        """
+            A worker went away: every member it was serving leaves its room.
+        """
+        for room_code, room in list(self._rooms.items()):
+            for client in list(room.getmembers()):
+                if client.conn == worker:
+                    self._leave(room_code, client.getipaddr(), worker)
+
+class RemoteConnection:
+    """
+        Stand-in for a Connection served by another worker.
+        Frames are forwarded to that worker through the broker.
+    """
+    def __init__(self, registry, worker, room_code, ip):
+        self.ip=ip
+        self.encoding=codec.JSON # frames cross the broker as JSON text
+        self.features=frozenset() # not shared between workers, remote members get plain frames
+        self._registry=registry
+        self._worker=worker
+        self._room_code=room_code
+
+    @property
+    def closed(self):
+        return not self._registry.connected
+
+    def send(self, frame:codec.Frame, received_at=None) -> bool:
+        if self.closed:
+            return False
+        text = frame.encode(codec.JSON)
+        self._registry._post({"op": "deliver", "worker": self._worker, "room": self._room_code, "ip": self.ip, "text": text})
+        return True
+
+class ClusterRegistry(RoomRegistry):
+    """
+        RoomRegistry of a worker process. Creating, joining and leaving are validated by
+        the broker, and changes made on other workers are applied to the local mirror.
+    """
+    persistent = False # the broker owns the room directory
+
+    def __init__(self, worker_id, path):
+        super().__init__()
+        self.worker_id=worker_id
+        self._path=path
+        self._writer=None
+        self._listener=None
+        self._pending={} # {request id: Future}
+        self._next_rid=0
+        self.on_release=None # coroutine function(token) dropping the member of a resume token of this worker
+        self._closing=False
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, app=None):
+        reader, self._writer = await asyncio.open_unix_connection(self._path, limit=STREAM_LIMIT)
+        self._post({"op": "hello", "worker": self.worker_id})
+        self._listener = asyncio.create_task(self._listen(reader))
+
+    async def close(self, app=None):
+        self._closing=True
+        if self._listener:
+            self._listener.cancel()
+        if self._writer:
+            self._writer.close()
+
+    def _post(self, msg):
+        self._writer.write(_encode(msg))
+
+    async def _call(self, msg):
+        if not self.connected:
+            raise RegistryUnavailable("Lost the broker connection")
+        self._next_rid += 1
+        msg["rid"] = self._next_rid
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_rid] = future
+        self._post(msg)
+        return await future
+
+    async def _claim(self, room_code, password_hash, host_user: Users, conn, creator) -> bool:
+        reply = await self._call({
+            "op": "create", "room": room_code, "password": password_hash,
+            "owner": host_user.toJSON(), "worker": self.worker_id if conn is not None else None,
+            "creator": creator
+        })
+        return reply["ok"]
+
+    async def join(self, room, newuser: Users, password_hash, conn=None) -> int:
+        reply = await self._call({
+            "op": "join", "room": room.getcode(), "password": password_hash, "user": newuser.toJSON()
+        })
+        if reply["status"] == 1:
+            await super().join(room, newuser, password_hash, conn)
+        return reply["status"]
+
+    async def drop(self, room, peerip:str) -> bool:
+        self._post({"op": "leave", "room": room.getcode(), "ip": peerip})
+        return await super().drop(room, peerip)
+
+    async def record(self, room, message:dict) -> dict:
+        # Numbered by the broker so sequence numbers are per room, not per worker
+        reply = await self._call({"op": "record", "room": room.getcode(), "message": message})
+        return reply["message"]
+
+    async def replay(self, room, seq:int) -> dict:
+        reply = await self._call({"op": "history", "room": room.getcode(), "after": seq})
+        return reply["history"]
+
+    def session_token(self) -> str:
+        # Names the issuing worker, so a client resuming on another worker can be released there
+        return f"{self.worker_id}.{super().session_token()}"
+
+    async def release(self, token):
+        """
+            Ask the worker that issued token to drop its member. Returns once the broker
+            has removed it, so the client can join again right away.
+        """
+        worker, sep, _ = token.partition(".")
+        try:
+            worker = int(worker)
+        except ValueError:
+            return
+        if not sep or worker == self.worker_id or not self.connected:
+            return
+        await self._call({"op": "release", "worker": worker, "token": token})
+
+    async def _release(self, msg):
+        try:
+            if self.on_release is not None:
+                await self.on_release(msg["token"])
+        finally:
+            # posted after the leave of the member, so the broker has removed it when the answer arrives
+            if self.connected:
+                self._post({"op": "released", "worker": msg["worker"], "reply": msg["reply"]})
+
+    def _expire(self, room):
+        # Every worker sees the room go idle, the broker deletes it once and tells all of them
+        self._post({"op": "expire", "room": room.getcode()})
+
+    async def _listen(self, reader):
+        try:
+            await self._receive(reader)
+        except OSError as e:
+            logging.error("Worker %s lost its broker connection: %s", self.worker_id, e)
+        else:
+            logging.error("Worker %s lost its broker connection", self.worker_id)
+        finally:
+            # Calls waiting for an answer fail instead of hanging, with the locks they hold
+            self._writer.close()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(RegistryUnavailable("Lost the broker connection"))
+            if not self._closing:
+                # Without the broker the worker can only turn clients away. It shuts down
+                # gracefully, its clients resume on the other workers, and serve() starts it again.
+                logging.error("Worker %s stopping, it will be restarted", self.worker_id)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+    async def _receive(self, reader):
+        async for line in reader:
+            msg = json.loads(line)
+            rid = msg.get("rid")
+            if rid is not None:
+                future = self._pending.pop(rid, None)
+                if future and not future.done():
+                    future.set_result(msg)
+                continue
+            op = msg["op"]
+            if op == "deliver":
+                room = self._rooms.get(msg["room"])
+                conn = room.getconnection(msg["ip"]) if room else None
+                if conn is not None:
+                    conn.send(codec.Frame(raw=msg["text"]))
+            elif op == "created":
+                owner = Users(msg["owner"]["username"], msg["owner"]["ip"], msg["owner"].get("features", ()))
+                room = Rooms(msg["room"], msg["password"], owner)
+                if msg["worker"] is not None:
+                    room.setconnection(owner.getipaddr(), RemoteConnection(self, msg["worker"], msg["room"], owner.getipaddr()))
+                if msg["room"] not in self._rooms:
+                    self._add(room, msg["creator"])
+            elif op == "joined":
+                room = self._rooms.get(msg["room"])
+                if room is not None:
+                    user = Users(msg["user"]["username"], msg["user"]["ip"], msg["user"].get("features", ()))
+                    if room.addclient(user, msg["password"]) == 1:
+                        room.setconnection(user.getipaddr(), RemoteConnection(self, msg["worker"], msg["room"], user.getipaddr()))
+                        self._member_joined(room, user)
+            elif op == "left":
+                room = self._rooms.get(msg["room"])
+                if room is not None:
+                    self._member_left(room, msg["ip"])
+            elif op == "expired":
+                room = self._rooms.get(msg["room"])
+                if room is not None:
+                    self._remove(room)
+            elif op == "release":
+                asyncio.create_task(self._release(msg))
+
+def _run_broker(path):
+    setup_logging()
+    try:
+        asyncio.run(Broker(path).serve())
+    except KeyboardInterrupt:
+        pass
+
+def _run_worker(worker_id, path, host, port, init_worker):
+    setup_logging()
+    registry = ClusterRegistry(worker_id, path)
+    app = init_worker(registry)
+    app.on_startup.append(registry.connect)
+    app.on_cleanup.append(registry.close)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    logging.info("Worker %s serving on %s:%s", worker_id, host, port)
+    web.run_app(app, sock=sock, print=None)
+
+def _start_broker(ctx, path):
+    """
+        Start the broker and wait for its socket. Returns the process, None if it did not start.
+    """
+    if os.path.exists(path):
+        os.unlink(path) # the socket of a previous broker would pass for this one
+    broker = ctx.Process(target=_run_broker, args=(path,), name="broker", daemon=True)
+    broker.start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path):
+        if time.monotonic() > deadline or not broker.is_alive():
+            broker.terminate()
+            return None
+        time.sleep(0.05)
+    return broker
+
+def _start_worker(ctx, worker_id, path, host, port, init_worker):
+    proc = ctx.Process(target=_run_worker, args=(worker_id, path, host, port, init_worker), name=f"worker-{worker_id}")
+    proc.start()
+    return proc
+
+def serve(workers, host, port, init_worker, path=None):
+    """
+        Run a broker and `workers` aiohttp processes sharing host:port, and start again
+        any of them that stops. A worker stops when it loses the broker.
+        init_worker(registry) installs the registry in the app and returns the app.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("Worker mode needs SO_REUSEPORT and unix sockets, run with a single worker instead")
+    path = path or settings.BROKER_SOCKET
+    ctx = multiprocessing.get_context("fork")
+
+    broker = _start_broker(ctx, path)
+    if broker is None:
+        sys.exit("Broker failed to start")
+    procs = [_start_worker(ctx, i, path, host, port, init_worker) for i in range(workers)]
+
+    # Docker stops the container with SIGTERM, turn it into a clean shutdown of the children
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            time.sleep(RESTART_CHECK)
+            if broker is None or not broker.is_alive():
+                # The room directory is lost with it, every worker stops and is restarted below
+                logging.error("Broker stopped, restarting it")
+                broker = _start_broker(ctx, path)
+                continue
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    logging.error("Worker %s exited with code %s, restarting it", i, proc.exitcode)
+                    procs[i] = _start_worker(ctx, i, path, host, port, init_worker)
+    except (KeyboardInterrupt, SystemExit):
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+    finally:
+        if broker is not None:
+            broker.terminate()
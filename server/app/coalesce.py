@@ -0,0 +1,55 @@
+import asyncio
+import codec
+import settings
+
+## ICE candidate coalescing. Trickle ICE sends dozens of tiny frames per peer pair
+## while a connection is set up. For recipients that advertised the "ice-batch"
+## feature on join, the candidates one client sends them within ICE_BATCH_WINDOW
+## are delivered as a single frame:
+##   {"type": "ice-batch", "candidates": [candidate, ...], "from_ip": ..., "from_user": ...}
+
+ICE_BATCH = "ice-batch"
+
+def accepts_batches(conn) -> bool:
+    return ICE_BATCH in conn.features
+
+class IceCoalescer:
+    """
+        Holds the candidates one client sends to each recipient until the window ends
+        or ICE_BATCH_MAX candidates are pending, then queues one ice-batch frame per recipient.
+    """
+    def __init__(self, session, window=None, limit=None):
+        self._session=session
+        self._window=settings.ICE_BATCH_WINDOW if window is None else window
+        self._limit=limit or settings.ICE_BATCH_MAX
+        self._pending={} # {Connection: [candidates]}
+        self._received_at={} # {Connection: perf_counter() time the first pending candidate arrived}
+        self._timer=None
+
+    def add(self, conn, candidate, received_at=None):
+        batch = self._pending.get(conn)
+        if batch is None:
+            batch = self._pending[conn] = []
+            self._received_at[conn] = received_at
+        batch.append(candidate)
+        if len(batch) >= self._limit:
+            self._send(conn)
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self.flush)
+
+    def flush(self):
+        """
+            Send everything that is pending. Called when the window ends, before the client
+            relays any other frame (so candidates never overtake it) and when it disconnects.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for conn in list(self._pending):
+            self._send(conn)
+
+    def _send(self, conn):
+        candidates = self._pending.pop(conn)
+        received_at = self._received_at.pop(conn)
+        if not conn.closed:
+            conn.send(codec.Frame({"type": ICE_BATCH, "candidates": candidates}, self._session.sender_fields), received_at)
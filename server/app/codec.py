@@ -0,0 +1,153 @@
+import json
+
+## Codecs for signaling frames. JSON travels in text websocket frames and is encoded
+## with orjson when it is installed, otherwise the standard library with compact separators.
+## MessagePack travels in binary frames and is available when msgpack is installed.
+## A client picks its encoding with the websocket subprotocol, see PROTOCOLS.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+if orjson is not None:
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    loads = json.loads
+    _encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(obj) -> str:
+        return _encoder.encode(obj)
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+def _check_json(obj):
+    """
+        Raise ValueError if obj holds a value JSON has no type for: MessagePack bin
+        and ext values or non string keys. Frames are relayed to clients of either
+        encoding, such a frame could not be encoded for a JSON client.
+    """
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if not all(isinstance(key, str) for key in value):
+                raise ValueError("map keys must be strings")
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif not isinstance(value, _JSON_SCALARS):
+            raise ValueError(f"{type(value).__name__} value has no JSON equivalent")
+
+if msgpack is not None:
+    def unpack(data):
+        obj = msgpack.unpackb(data)
+        _check_json(obj)
+        return obj
+
+    pack = msgpack.packb
+    ENCODINGS = (MSGPACK, JSON)
+else:
+    def unpack(data):
+        raise ValueError("msgpack is not installed")
+
+    def pack(obj) -> bytes:
+        raise ValueError("msgpack is not installed")
+
+    ENCODINGS = (JSON,)
+
+# Websocket subprotocols in order of preference. A client that asks for none gets JSON.
+PROTOCOLS = tuple(f"cryptic.{encoding}" for encoding in ENCODINGS)
+
+def encoding_of(protocol) -> str:
+    return MSGPACK if protocol == f"cryptic.{MSGPACK}" else JSON
+
+def encode(obj, encoding):
+    return pack(obj) if encoding == MSGPACK else dumps(obj)
+
+class Members:
+    """
+        Object members to splice into frames, encoded once for every encoding.
+    """
+    __slots__ = ("fields", "json", "packed")
+
+    def __init__(self, **fields):
+        self.fields=fields
+        self.json=",".join(f"{dumps(key)}:{dumps(value)}" for key, value in fields.items())
+        self.packed=b"".join(pack(key) + pack(value) for key, value in fields.items()) if msgpack else None
+
+def splice(raw, members:Members):
+    """
+        Append already encoded members to the object in raw without decoding or
+        re-encoding it. raw is a JSON object (str) or a MessagePack map (bytes),
+        i.e. it was parsed into a dict. A member already present in raw is
+        overridden, both parsers keep the last duplicate.
+    """
+    if isinstance(raw, bytes):
+        return _splice_packed(raw, members.packed, len(members.fields))
+    body = raw.rstrip()[:-1].rstrip()
+    if body.endswith("{"):
+        return body + members.json + "}"
+    return body + "," + members.json + "}"
+
+def _splice_packed(raw:bytes, packed:bytes, count:int) -> bytes:
+    head = raw[0]
+    if head & 0xf0 == 0x80: # fixmap
+        size, body = head & 0x0f, raw[1:]
+    elif head == 0xde: # map 16
+        size, body = int.from_bytes(raw[1:3], "big"), raw[3:]
+    elif head == 0xdf: # map 32
+        size, body = int.from_bytes(raw[1:5], "big"), raw[5:]
+    else:
+        raise ValueError("not a MessagePack map")
+    size += count
+    if size < 16:
+        header = bytes((0x80 | size,))
+    elif size < 0x10000:
+        header = b"\xde" + size.to_bytes(2, "big")
+    else:
+        header = b"\xdf" + size.to_bytes(4, "big")
+    return header + body + packed
+
+class Frame:
+    """
+        An outgoing frame, encoded at most once for each encoding its recipients use.
+        Built from a dict, or from the raw frame a client sent (a str for JSON, bytes
+        for MessagePack) so it is passed on without re-encoding to recipients that use
+        the same encoding. members are added to the frame in every encoding.
+    """
+    __slots__ = ("_data", "_raw", "_members", "_encoded")
+
+    def __init__(self, data=None, members:Members=None, raw=None):
+        self._data=data
+        self._raw=raw
+        self._members=members
+        self._encoded={} # {encoding: str or bytes}
+
+    def encode(self, encoding):
+        frame = self._encoded.get(encoding)
+        if frame is None:
+            raw = self._raw
+            if raw is not None and isinstance(raw, bytes) == (encoding == MSGPACK):
+                frame = splice(raw, self._members) if self._members else raw
+            else:
+                data = self._data
+                if data is None:
+                    data = self._data = unpack(raw) if isinstance(raw, bytes) else loads(raw)
+                if self._members:
+                    data = dict(data, **self._members.fields)
+                frame = encode(data, encoding)
+            self._encoded[encoding] = frame
+        return frame
@@ -0,0 +1,89 @@
+import asyncio
+import codec
+
+## Room membership events for clients that do not hold a websocket, streamed as
+## server-sent events by /room/{room_code}/events. Subscribers are indexed by room,
+## so publishing an event costs one encode plus one queue put per subscriber of
+## that room, whatever the number of rooms and subscribers on the server.
+
+SUBSCRIBER_QUEUE = 64 # events buffered for one subscriber before it is dropped as too slow
+
+def sse(event, data) -> bytes:
+    return f"event: {event}\ndata: {codec.dumps(data)}\n\n".encode()
+
+class Subscription:
+    """
+        Events of one room for one subscriber. get() returns None once the
+        room is gone or the subscriber fell too far behind.
+    """
+    def __init__(self, hub, room_code):
+        self.room_code=room_code
+        self._hub=hub
+        self._queue=asyncio.Queue(SUBSCRIBER_QUEUE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._hub.unsubscribe(self)
+
+    async def get(self):
+        return await self._queue.get()
+
+    def put(self, frame):
+        try:
+            self._queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._hub.unsubscribe(self)
+            self.close()
+
+    def close(self):
+        # make room for the end marker, the subscriber is leaving anyway
+        while self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+class RoomEvents:
+    """
+        Index of event subscribers by room code.
+    """
+    def __init__(self):
+        self._subscribers={} # {room_code: set of Subscription}
+
+    def __len__(self):
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, room_code) -> Subscription:
+        sub = Subscription(self, room_code)
+        self._subscribers.setdefault(room_code, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        subs = self._subscribers.get(sub.room_code)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.room_code]
+
+    def publish(self, room_code, event, data):
+        """
+            Send an event to every subscriber of room_code, encoded once.
+        """
+        subs = self._subscribers.get(room_code)
+        if not subs:
+            return
+        frame = sse(event, data)
+        for sub in list(subs):
+            sub.put(frame)
+
+    def close(self, room_code):
+        """
+            The room is gone: tell its subscribers and end their streams.
+        """
+        subs = self._subscribers.pop(room_code, None)
+        if not subs:
+            return
+        frame = sse("closed", {"room": room_code})
+        for sub in subs:
+            sub.put(frame)
+            sub.close()
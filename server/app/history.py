@@ -0,0 +1,78 @@
+from collections import deque
+from itertools import islice
+import codec
+import settings
+
+## Chat history of a room. Every message relayed by the server gets the next
+## sequence number of its room and is kept in a ring buffer capped both in
+## messages and in encoded bytes, so a client that reconnects can ask for
+## everything after the last sequence number it saw.
+
+def history_of(room) -> "RoomHistory":
+    """
+        The history of a room, created with its first message.
+    """
+    if room.history is None:
+        room.history = RoomHistory(room.getcode(), settings.HISTORY_MESSAGES, settings.HISTORY_BYTES)
+    return room.history
+
+class RoomHistory:
+    """
+        Last messages of one room, oldest first. Sequence numbers start at 1 and
+        the buffered ones are contiguous, so looking up a sequence number is arithmetic.
+    """
+    def __init__(self, room_code, max_messages, max_bytes):
+        self.room_code=room_code
+        self.max_messages=max_messages
+        self.max_bytes=max_bytes
+        self.last_seq=0
+        self._messages=deque() # (message, encoded size)
+        self._bytes=0
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def first_seq(self):
+        """
+            Sequence number of the oldest buffered message, last_seq + 1 when empty.
+        """
+        return self.last_seq - len(self._messages) + 1
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def append(self, message:dict) -> dict:
+        """
+            Number a message, setting its "seq" and "id", and buffer it.
+            The oldest messages are evicted once a cap is exceeded. Returns message.
+        """
+        self.last_seq += 1
+        message["seq"] = self.last_seq
+        message["id"] = f"{self.room_code}_{self.last_seq}"
+        size = len(codec.dumps(message))
+        self._messages.append((message, size))
+        self._bytes += size
+        while self._messages and (len(self._messages) > self.max_messages or self._bytes > self.max_bytes):
+            self._bytes -= self._messages.popleft()[1]
+        return message
+
+    def after(self, seq:int) -> list:
+        """
+            Buffered messages with a sequence number greater than seq.
+        """
+        start = max(0, seq - self.first_seq + 1)
+        return [message for message, size in islice(self._messages, start, None)]
+
+    def replay(self, seq:int) -> dict:
+        """
+            The messages after seq in the shape of a history frame. first_seq greater
+            than seq + 1 tells the client that older messages were evicted.
+        """
+        return {
+            "room": self.room_code,
+            "first_seq": self.first_seq,
+            "last_seq": self.last_seq,
+            "messages": self.after(seq),
+        }
@@ -0,0 +1,80 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+import settings
+
+## Logging for the server. Records are put on a queue by the event loop and formatted
+## and written by a background thread, so a slow stderr never blocks the loop.
+## The per-frame relay logs go to the "cryptic.relay" logger, which is off by default,
+## sampled when enabled, and only formatted by the background thread.
+
+RELAY_LOGGER = "cryptic.relay"
+
+class SampledLogger:
+    """
+        Front for a logger used on a hot path. The level check and the sampling
+        (one record out of every `rate`) happen before any LogRecord is built.
+    """
+    def __init__(self, name, rate=1):
+        self.logger=logging.getLogger(name)
+        self.rate=rate
+        self._seen=0
+
+    def debug(self, msg, *args):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._seen += 1
+            if self._seen % self.rate == 0:
+                self.logger.debug(msg, *args)
+
+class StructuredFormatter(logging.Formatter):
+    """
+        Format records as a single line of key=value pairs.
+        Extra fields can be attached with logger.info(..., extra={"fields": {...}}).
+    """
+    def format(self, record):
+        created = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        msg = record.getMessage().replace('"', '\\"')
+        line = f'ts={created}.{int(record.msecs):03d} level={record.levelname} logger={record.name} msg="{msg}"'
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += "".join(f" {key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+        QueueHandler that leaves formatting to the listener thread.
+        The stock handler merges msg and args on the calling thread.
+    """
+    def prepare(self, record):
+        return record
+
+relay_log = SampledLogger(RELAY_LOGGER, settings.RELAY_LOG_SAMPLE) # per-frame relay logs
+
+def _flush(listener):
+    if listener._thread is not None: # already stopped by the caller
+        listener.stop()
+
+def setup_logging(level=None, relay_level=None, relay_sample=None, stream=None):
+    """
+        Route every log record through a queue to a background writer thread.
+        Must be called in each process, a forked child does not inherit the writer thread.
+        Returns the QueueListener so callers can stop it.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(StructuredFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(_flush, listener)
+
+    root = logging.getLogger()
+    root.handlers = [LazyQueueHandler(log_queue)]
+    root.setLevel(level or settings.LOG_LEVEL)
+
+    relay_log.logger.setLevel(relay_level or settings.RELAY_LOG_LEVEL)
+    relay_log.rate = max(1, relay_sample or settings.RELAY_LOG_SAMPLE)
+    return listener
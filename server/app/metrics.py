@@ -0,0 +1,99 @@
+from bisect import bisect_left
+
+## Minimal in-process metrics rendered in the Prometheus text format.
+## Updating a metric is a dict or list increment so it can sit on the relay hot path.
+## In worker mode every worker exposes its own metrics.
+
+_metrics=[]
+
+class Counter:
+    """
+        Monotonic counter, optionally split by the value of one label.
+    """
+    def __init__(self, name, help, label=None):
+        self.name=name
+        self.help=help
+        self.label=label
+        self.values={}
+        _metrics.append(self)
+
+    def inc(self, labelvalue=None, amount=1):
+        self.values[labelvalue] = self.values.get(labelvalue, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labelvalue, value in self.values.items():
+            labels = f'{{{self.label}="{labelvalue}"}}' if self.label else ""
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+class Gauge:
+    """
+        Gauge that is either set by the caller or read from a function at scrape time.
+    """
+    def __init__(self, name, help, function=None):
+        self.name=name
+        self.help=help
+        self.value=0
+        self._function=function
+        _metrics.append(self)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def render(self):
+        value = self._function() if self._function else self.value
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    """
+        Histogram with fixed upper bounds. Observing is a binary search and two additions.
+    """
+    def __init__(self, name, help, buckets):
+        self.name=name
+        self.help=help
+        self.buckets=tuple(sorted(buckets))
+        self.counts=[0] * (len(self.buckets) + 1) # last slot is +Inf
+        self.sum=0
+        _metrics.append(self)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+def render() -> str:
+    """
+        All registered metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+OPEN_WEBSOCKETS = Gauge("cryptic_open_websockets", "Websocket connections currently open")
+MESSAGES = Counter("cryptic_messages_total", "Signaling frames received by type", label="type")
+EVICTIONS = Counter("cryptic_slow_consumer_total", "Frames dropped or connections evicted for slow consumers", label="action")
+RELAY_LATENCY = Histogram(
+    "cryptic_relay_latency_seconds", "Time from receiving a frame to send_str completing for one recipient",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+PAYLOAD_SIZE = Histogram(
+    "cryptic_payload_bytes", "Size of received signaling frames",
+    (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+)
+ROOMS_EXPIRED = Counter("cryptic_rooms_expired_total", "Rooms deleted by the reaper after being idle")
+RATE_LIMITED = Counter("cryptic_rate_limited_total", "Frames rejected by the rate limiter by type", label="type")
+ADMISSION_REJECTED = Counter("cryptic_admission_rejected_total", "Websockets turned away with 503 by admission control")
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+## Token buckets for rate limiting signaling frames. Buckets are refilled lazily when
+## they are used, so checking a frame is a dict lookup and a few float operations.
+
+class TokenBucket:
+    """
+        Holds up to `burst` tokens and gains `rate` tokens per second.
+    """
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate=rate
+        self.burst=burst
+        self.tokens=burst
+        self.stamp=now
+
+    def take(self, now) -> float:
+        """
+            Take one token. Returns 0 on success, otherwise the seconds until a token is available.
+        """
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0.0
+        self.tokens = tokens
+        return (1 - tokens) / self.rate
+
+class RateLimiter:
+    """
+        One token bucket per (key, message type), e.g. per client address or per room.
+        limits maps a message type to (rate per second, burst), types not listed are not limited.
+        Buckets are kept in least recently used order so prune() only visits idle ones.
+    """
+    def __init__(self, limits):
+        self.limits=limits
+        self._buckets=OrderedDict() # {(key, message type): TokenBucket}, least recently used first
+        # a bucket unused for this long is full again and can be forgotten
+        self._idle=max((burst / rate for rate, burst in limits.values()), default=0)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, key, message_type, now) -> float:
+        """
+            Returns 0 if the frame is allowed, otherwise the seconds the sender should wait.
+        """
+        limit = self.limits.get(message_type)
+        if limit is None:
+            return 0.0
+        bucket = self._buckets.get((key, message_type))
+        if bucket is None:
+            bucket = self._buckets[(key, message_type)] = TokenBucket(limit[0], limit[1], now)
+        else:
+            self._buckets.move_to_end((key, message_type))
+        return bucket.take(now)
+
+    def prune(self, now) -> int:
+        """
+            Forget the buckets that refilled completely. Returns how many were removed.
+        """
+        removed = 0
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if now - bucket.stamp < self._idle:
+                break
+            self._buckets.popitem(last=False)
+            removed += 1
+        return removed
+
+def parse_limits(spec:str) -> dict:
+    """
+        Parse "type=rate:burst,..." e.g. "join=1:5,message=5:20" into {type: (rate, burst)}.
+    """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        message_type, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        limits[message_type.strip()] = (float(rate), float(burst or rate))
+    return limits
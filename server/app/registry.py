@@ -0,0 +1,273 @@
+import logging
+import secrets
+from asyncio import Lock
+from contextlib import asynccontextmanager
+from rooms import Rooms
+from user import Users
+from events import RoomEvents
+from history import history_of
+from timers import wheel
+import metrics
+import settings
+
+class RoomLimitReached(Exception):
+    """
+        Raised by RoomRegistry.creating when the global or the per-address room cap is hit.
+        scope is "server" or "address".
+    """
+    def __init__(self, message, scope):
+        super().__init__(message)
+        self.scope=scope
+
+class RegistryUnavailable(Exception):
+    """
+        Raised when the registry cannot reach the process that owns the room directory,
+        see cluster.ClusterRegistry.
+    """
+
+class RoomRegistry:
+    """
+        RoomRegistry holds every live room of the server indexed by room code.
+        Creating, joining and dropping go through the registry so that the check
+        and the mutation happen atomically, even when the caller awaits in between.
+        Lock ordering is always registry lock -> room lock.
+
+        Rooms without any connection (created through /room/new, or whose remaining
+        members are all offline) are idle and expire after ROOM_IDLE_TTL seconds,
+        through a timer on the server's timer wheel (see timers.py).
+    """
+    persistent = True # its rooms can be saved and restored across restarts, see snapshot.py
+
+    def __init__(self):
+        self._rooms={} # {room_code: Rooms}
+        self._lock=Lock() ## guards room code allocation
+        self._idle={} # {room_code: Timer expiring the idle room}
+        self._creators={} # {room_code: address that created the room}
+        self._created_by={} # {address: number of live rooms it created}
+        self.events=RoomEvents() # membership events for /room/{room_code}/events
+
+    def __contains__(self, room_code):
+        return room_code in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __iter__(self):
+        return iter(self._rooms)
+
+    def get(self, room_code):
+        return self._rooms.get(room_code)
+
+    def items(self):
+        return self._rooms.items()
+
+    def created_by(self, address) -> int:
+        return self._created_by.get(address, 0)
+
+    def session_token(self) -> str:
+        """
+            A new resume token, see signaling_server.Session.
+        """
+        return secrets.token_urlsafe(18)
+
+    async def release(self, token):
+        """
+            Give up the membership held by a resume token this process does not know,
+            so that its client can join again. A single process knows all its tokens.
+        """
+
+    def creator_of(self, room_code):
+        return self._creators.get(room_code)
+
+    def restore(self, room_code, password_hash, owner: Users, members, locked, creator, owner_present=True):
+        """
+            Recreate a room from a snapshot, every member offline. owner_present is False
+            if the owner had left the room, it keeps owning it without being a member.
+            Returns the room, None if the room code is taken.
+        """
+        if room_code in self._rooms:
+            return None
+        room = Rooms(room_code, password_hash, owner)
+        if not owner_present:
+            room.dropclient(owner.getipaddr())
+        for user in members:
+            room.addclient(user, password_hash)
+        if locked:
+            room.lockroom(owner)
+        self._add(room, creator or owner.getipaddr())
+        return room
+
+    @asynccontextmanager
+    async def creating(self, room_code, password_hash, host_user: Users, conn=None, creator=None):
+        """
+            Create a new room and yield it with its lock held, so nobody can join
+            before the owner has been told the room exists.
+            creator is the address charged for the room, the host address by default.
+            Yields None if the room code is already taken.
+            Raises RoomLimitReached if MAX_ROOMS or MAX_ROOMS_PER_IP would be exceeded.
+        """
+        creator = creator or host_user.getipaddr()
+        async with self._lock:
+            if room_code in self._rooms:
+                room = None
+            else:
+                if len(self._rooms) >= settings.MAX_ROOMS:
+                    raise RoomLimitReached("Server room limit reached", "server")
+                if self.created_by(creator) >= settings.MAX_ROOMS_PER_IP:
+                    raise RoomLimitReached("Too many rooms created from this address", "address")
+                if not await self._claim(room_code, password_hash, host_user, conn, creator):
+                    room = None
+                else:
+                    room = Rooms(room_code, password_hash, host_user)
+                    if conn is not None:
+                        room.setconnection(host_user.getipaddr(), conn)
+                    await room.lock.acquire() # fresh lock, never contended
+                    self._add(room, creator)
+        if room is None:
+            yield None
+            return
+        try:
+            yield room
+        finally:
+            room.lock.release()
+
+    @asynccontextmanager
+    async def locked(self, room_code):
+        """
+            Yield the room identified by room_code with its lock held.
+            Yields None if the room does not exist or was deleted while waiting for the lock.
+        """
+        room = self._rooms.get(room_code)
+        if room is None:
+            yield None
+            return
+        async with room.lock:
+            yield room if self._rooms.get(room_code) is room else None
+
+    async def join(self, room, newuser: Users, password_hash, conn=None) -> int:
+        """
+            Add a user and its connection to a room. The caller must hold the room lock.
+            Returns the status of Rooms.addclient.
+        """
+        status = room.addclient(newuser, password_hash)
+        if status == 1:
+            if conn is not None:
+                room.setconnection(newuser.getipaddr(), conn)
+            self._member_joined(room, newuser)
+        return status
+
+    async def drop(self, room, peerip:str) -> bool:
+        """
+            Drop a user and its connection from a room, deleting the room once it is empty.
+            The caller must hold the room lock. Returns True if the room was deleted.
+        """
+        return self._member_left(room, peerip)
+
+    def detach(self, room, peerip:str):
+        """
+            Unbind the connection of a member that went offline but may still resume,
+            keeping its membership. The caller must hold the room lock.
+        """
+        room.setconnection(peerip, None)
+        self._touch(room)
+
+    def attach(self, room, peerip:str, conn):
+        """
+            Bind the new connection of a resumed member. The caller must hold the room lock.
+        """
+        room.setconnection(peerip, conn)
+        self._touch(room)
+
+    async def record(self, room, message:dict) -> dict:
+        """
+            Give a chat message the next sequence number of its room and keep it in the
+            room history. Returns the numbered message, None if the room is gone.
+        """
+        return history_of(room).append(message)
+
+    async def replay(self, room, seq:int) -> dict:
+        """
+            The history frame of a room for a client that saw everything up to seq,
+            None if the room is gone.
+        """
+        return history_of(room).replay(seq)
+
+    def _member_joined(self, room, user: Users):
+        self._touch(room)
+        self.events.publish(room.getcode(), "join", user.toJSON())
+
+    def _member_left(self, room, peerip:str) -> bool:
+        user = room.getclient(peerip)
+        room.dropclient(peerip)
+        if user is not None:
+            self.events.publish(room.getcode(), "leave", {"ip": peerip, "user": user.getname()})
+        if room.getclientnos() == 0:
+            self._remove(room)
+            return True
+        self._touch(room)
+        return False
+
+    def _idle_expired(self, room):
+        """
+            Timer callback: delete a room that stayed idle for ROOM_IDLE_TTL seconds.
+        """
+        room_code = room.getcode()
+        self._idle.pop(room_code, None)
+        if self._rooms.get(room_code) is not room or room.isonline():
+            return
+        if room.lock.locked(): # someone is joining right now, look again later
+            self._touch(room)
+            return
+        self._expire(room)
+        metrics.ROOMS_EXPIRED.inc()
+        logging.info("Room %s expired after %ss without connections", room_code, settings.ROOM_IDLE_TTL)
+
+    def _add(self, room, creator):
+        room_code = room.getcode()
+        self._rooms[room_code] = room
+        self._creators[room_code] = creator
+        self._created_by[creator] = self._created_by.get(creator, 0) + 1
+        self._touch(room)
+
+    def _remove(self, room):
+        room_code = room.getcode()
+        if self._rooms.get(room_code) is not room:
+            return
+        del self._rooms[room_code]
+        timer = self._idle.pop(room_code, None)
+        if timer is not None:
+            timer.cancel()
+        self.events.close(room_code)
+        creator = self._creators.pop(room_code, None)
+        if creator is not None:
+            count = self._created_by[creator] - 1
+            if count:
+                self._created_by[creator] = count
+            else:
+                del self._created_by[creator]
+
+    def _touch(self, room):
+        """
+            Start the idle clock of a room that lost its last connection, stop it for one that has any.
+            A room that is already idle keeps its original deadline.
+        """
+        room_code = room.getcode()
+        if room.isonline():
+            timer = self._idle.pop(room_code, None)
+            if timer is not None:
+                timer.cancel()
+        elif room_code not in self._idle:
+            self._idle[room_code] = wheel.schedule(settings.ROOM_IDLE_TTL, self._idle_expired, room)
+
+    def _expire(self, room):
+        """
+            Delete a room that expired while idle. Subclasses may defer the deletion.
+        """
+        self._remove(room)
+
+    async def _claim(self, room_code, password_hash, host_user: Users, conn, creator) -> bool:
+        """
+            Hook called under the registry lock before a room is created locally.
+            Returning False reports the room code as taken.
+        """
+        return True
@@ -1,17 +1,34 @@
-from user import Users
+from user import Users, intern
 from asyncio import Lock
 
 class Rooms:
+    """
+        A room and its members. _clients is the single membership table: every member
+        is one Users entry keyed by address, holding its connection as well.
+    """
+    __slots__ = ("_room_code", "_password", "_owner", "_clients", "_names", "_online", "_locked", "_lock", "history")
+
     def __init__ (self, code, password, headuser: Users):
-        self._room_code=code
+        self._room_code=intern(code)
         self._password=password
         self._owner=headuser
-        self._clients=[]
-        self._clients.append(headuser)
-        self._count=0
+        self._clients={headuser.getipaddr(): headuser} # {ip: Users}
+        self._names={headuser.getname(): headuser.getipaddr()} # {username: ip}
+        self._online=0 # members with a connection
         self._locked=False
         self._lock=Lock() ## mutex lock primitive for shared state during async functions
-        self.websockets = {} # {ip: ws}
+        self.history = None # RoomHistory of the chat messages, see history.py
+
+    @property
+    def lock(self):
+        """
+            Per-room lock. Hold it while membership or the connections of the room change
+            together with the notifications sent about that change.
+        """
+        return self._lock
+
+    def getcode(self):
+        return self._room_code
 
     def addclient(self, newuser: Users, provided_password: str) -> int:
         """
@@ -28,12 +45,12 @@ class Rooms:
             return -4
         if self._password!=provided_password:
             return -3
-        for i in self._clients:
-            if i.getname()==newuser.getname():
-                return -1
-            elif i.getipaddr()==newuser.getipaddr():
-                return -2
-        self._clients.append(newuser)
+        if newuser.getname() in self._names:
+            return -1
+        if newuser.getipaddr() in self._clients:
+            return -2
+        self._clients[newuser.getipaddr()]=newuser
+        self._names[newuser.getname()]=newuser.getipaddr()
         return 1
 
     def lockroom(self, requesteduser: Users)->bool:
@@ -56,6 +73,9 @@ class Rooms:
             return True
         return False
 
+    def islocked(self)->bool:
+        return self._locked
+
     def matchpassword(self, password)->bool:
         """
             Compare the password equivalency
@@ -76,21 +96,76 @@ class Rooms:
     def getownerinfo(self):
         return self._owner
 
+    def getpassword(self):
+        return self._password
+
     def dropclient(self, peerip:str):
         """
             Drop a specific user from the room identified by their ip address
         """
-        self._clients = [client for client in self._clients if client.getipaddr() != peerip]
+        client = self._clients.pop(peerip, None)
+        if client is None:
+            return
+        if client.conn is not None:
+            self._online -= 1
+        if self._names.get(client.getname()) == peerip:
+            del self._names[client.getname()]
+
+    def getclient(self, peerip:str):
+        """
+            Get the user connected from the given ip address, or None
+        """
+        return self._clients.get(peerip)
+
+    def getclientbyname(self, username:str):
+        """
+            Get the user with the given username, or None
+        """
+        peerip = self._names.get(username)
+        return self._clients.get(peerip) if peerip is not None else None
 
     def getclientnos(self):
         return len(self._clients)
 
+    def getconnection(self, peerip:str):
+        """
+            The connection of the member at peerip, None if it is offline or not a member
+        """
+        client = self._clients.get(peerip)
+        return client.conn if client is not None else None
+
+    def setconnection(self, peerip:str, conn):
+        """
+            Bind a connection to the member at peerip, or unbind it with None.
+            Does nothing if peerip is not a member.
+        """
+        client = self._clients.get(peerip)
+        if client is None:
+            return
+        self._online += (conn is not None) - (client.conn is not None)
+        client.conn = conn
+
+    def getconnections(self):
+        """
+            The connections of the members that are online
+        """
+        return [client.conn for client in self._clients.values() if client.conn is not None]
+
+    def getmembers(self):
+        return self._clients.values()
+
+    def isonline(self)->bool:
+        """
+            True if any member has a connection
+        """
+        return self._online > 0
+
     def getotherclients(self, peerip:str, json_encoder=None):
         """
         Get all the client info except your ownself.
         If a JSON encoder is provided, it returns a list of JSON-serialized objects.
         """
-        other_clients = [client for client in self._clients if client.getipaddr() != peerip]
+        other_clients = [client for ip, client in self._clients.items() if ip != peerip]
         if json_encoder:
             return [json_encoder(client) for client in other_clients]
         return other_clients
@@ -0,0 +1,87 @@
+import os
+from ratelimit import parse_limits
+
+## Server tunables. Every value can be overridden with an environment variable
+## of the same name prefixed with CRYPTIC_, e.g. CRYPTIC_OUTBOX_SIZE=512
+
+def _env(name, default, cast=str):
+    value = os.environ.get("CRYPTIC_" + name)
+    if value is None:
+        return default
+    return cast(value)
+
+# Maximum number of frames queued for a single websocket before it counts as a slow consumer
+OUTBOX_SIZE = _env("OUTBOX_SIZE", 256, int)
+# What to do with a slow consumer: "evict" closes its websocket, "drop" discards the frame
+SLOW_CONSUMER = _env("SLOW_CONSUMER", "evict")
+
+# Number of server processes sharing the port, more than 1 enables worker mode (see cluster.py)
+WORKERS = _env("WORKERS", 1, int)
+# Unix socket of the broker that connects the workers
+BROKER_SOCKET = _env("BROKER_SOCKET", "/tmp/cryptic-broker.sock")
+
+# Accept permessage-deflate on websockets when the client offers it (1) or never compress (0)
+WS_COMPRESS = _env("WS_COMPRESS", 1, int) == 1
+
+# Rooms are saved to this file periodically and on shutdown and restored on startup, empty (the default)
+# disables it. It holds password hashes and resume tokens: use a directory only the server user can write,
+# never a shared one like /tmp. Worker mode does not save rooms.
+SNAPSHOT_FILE = _env("SNAPSHOT_FILE", "")
+# Seconds between two snapshots
+SNAPSHOT_INTERVAL = _env("SNAPSHOT_INTERVAL", 30, float)
+
+# Seconds browsers may cache /static files without revalidating; the landing page is always revalidated
+STATIC_MAX_AGE = _env("STATIC_MAX_AGE", 7 * 24 * 3600, int)
+
+# Level of the server log
+LOG_LEVEL = _env("LOG_LEVEL", "INFO")
+# Level of the per-frame relay log (logger "cryptic.relay"), DEBUG turns it on
+RELAY_LOG_LEVEL = _env("RELAY_LOG_LEVEL", "WARNING")
+# Only one relay log record out of every RELAY_LOG_SAMPLE is written
+RELAY_LOG_SAMPLE = _env("RELAY_LOG_SAMPLE", 1, int)
+
+# Websockets served at once (per worker in worker mode), more wait in the accept queue
+MAX_CONNECTIONS = _env("MAX_CONNECTIONS", 10000, int)
+# Websockets waiting for a slot before new ones are turned away with 503
+ACCEPT_QUEUE = _env("ACCEPT_QUEUE", 1000, int)
+# Seconds a websocket waits in the accept queue before it is turned away
+ACCEPT_TIMEOUT = _env("ACCEPT_TIMEOUT", 5, float)
+# Retry-After of a turned away websocket in seconds, the actual value is jittered up to twice this
+RETRY_AFTER = _env("RETRY_AFTER", 5, int)
+
+# Resolution of the timer wheel driving heartbeats, timeouts and TTLs (see timers.py), in seconds
+TIMER_TICK = _env("TIMER_TICK", 1, float)
+# Seconds between websocket pings; a client that has not answered the previous ping is disconnected
+HEARTBEAT = _env("HEARTBEAT", 30, float)
+# Seconds a websocket may stay open without joining or resuming a room
+JOIN_TIMEOUT = _env("JOIN_TIMEOUT", 60, float)
+# Seconds a room without any connected websocket is kept, e.g. one created through /room/new
+ROOM_IDLE_TTL = _env("ROOM_IDLE_TTL", 600, float)
+# How often full rate limit buckets are forgotten, in seconds
+LIMITS_PRUNE_INTERVAL = _env("LIMITS_PRUNE_INTERVAL", 30, float)
+# Seconds between keepalive comments on an idle /room/{room_code}/events stream
+SSE_KEEPALIVE = _env("SSE_KEEPALIVE", 15, float)
+# Maximum number of open /room/{room_code}/events streams per address
+SSE_MAX_PER_IP = _env("SSE_MAX_PER_IP", 4, int)
+# Maximum number of rooms on the server (per worker in worker mode)
+MAX_ROOMS = _env("MAX_ROOMS", 100000, int)
+# Maximum number of live rooms created from a single address
+MAX_ROOMS_PER_IP = _env("MAX_ROOMS_PER_IP", 20, int)
+# Seconds the membership of a dropped websocket is kept for the client to resume it, 0 disables
+RESUME_GRACE = _env("RESUME_GRACE", 30, float)
+
+# Seconds ICE candidates for a client that supports "ice-batch" are held to be sent as one frame, 0 disables
+ICE_BATCH_WINDOW = _env("ICE_BATCH_WINDOW", 0.02, float)
+# An ice-batch frame is sent early once it holds this many candidates
+ICE_BATCH_MAX = _env("ICE_BATCH_MAX", 32, int)
+
+# Chat messages kept per room for clients that reconnect, capped in number and in encoded bytes
+HISTORY_MESSAGES = _env("HISTORY_MESSAGES", 200, int)
+HISTORY_BYTES = _env("HISTORY_BYTES", 64 * 1024, int)
+
+# Token bucket limits per message type as "type=rate:burst,...", rate in frames per second.
+# Frames over the limit are rejected with an error frame carrying retry_after.
+# Limits for each client address:
+RATE_LIMITS_IP = parse_limits(_env("RATE_LIMITS_IP", "join=1:5,events=1:5,message=5:20,history=2:10,resume=1:5,offer=10:40,answer=10:40,ice=50:200,ice-batch=20:80,bye=5:20"))
+# Limits for each room, shared by all its members:
+RATE_LIMITS_ROOM = parse_limits(_env("RATE_LIMITS_ROOM", "message=20:60,offer=50:200,answer=50:200,ice=500:2000,ice-batch=200:800,bye=20:80"))
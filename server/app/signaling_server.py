@@ -1,183 +1,559 @@
-import json
+import argparse
+import asyncio
 import logging
 import hashlib
-from aiohttp import web
+import math
+import time
+from aiohttp import web, WSCloseCode
 import pathlib
-from rooms import Rooms
+from registry import RoomRegistry, RoomLimitReached, RegistryUnavailable
 from user import Users, userencoder
-
-logging.basicConfig(level=logging.INFO)
+from broadcast import Connection, broadcast
+from ratelimit import RateLimiter
+from admission import Admission, AdmissionRejected
+from coalesce import ICE_BATCH, IceCoalescer, accepts_batches
+from timers import wheel
+import assets
+import codec
+import events
+import metrics
+import settings
+import snapshot
+from logsetup import relay_log, setup_logging # relay_log is off unless CRYPTIC_RELAY_LOG_LEVEL=DEBUG
 
 routes = web.RouteTableDef()
 
 BASE_DIR = pathlib.Path(__file__).parent
 INDEX_FILE = BASE_DIR / "index.html"
+STATIC_DIR = BASE_DIR / "static"
+
+# Landing page and static files, read and compressed once, see assets.py
+index_page = assets.load(INDEX_FILE, "no-cache")
+static_files = assets.AssetCache(STATIC_DIR, settings.STATIC_MAX_AGE)
+
+rooms = RoomRegistry() # room_code -> Rooms, see registry.py
+connections = set() # open websockets, closed on shutdown
+
+metrics.Gauge("cryptic_rooms", "Rooms currently registered", function=lambda: len(rooms))
+metrics.Gauge("cryptic_event_subscribers", "Open /room/{room_code}/events streams", function=lambda: len(rooms.events))
+
+admission = Admission(settings.MAX_CONNECTIONS, settings.ACCEPT_QUEUE, settings.ACCEPT_TIMEOUT, settings.RETRY_AFTER)
+metrics.Gauge("cryptic_accept_queue", "Websockets waiting for a connection slot", function=lambda: admission.queued)
+
+ip_limits = RateLimiter(settings.RATE_LIMITS_IP)
+room_limits = RateLimiter(settings.RATE_LIMITS_ROOM)
+
+# Fixed responses are encoded once per encoding on first use
+ERROR_FRAMES = {
+    message: codec.Frame({"type": "error", "message": message})
+    for message in ("Room already exists", "Room not found", "Session not found", "Server unavailable", "Already in a room")
+}
+JOIN_ERROR_FRAMES = {
+    status: codec.Frame({"type": "error", "message": message})
+    for status, message in {
+        -1: "Username not available",
+        -2: "IP address already in use",
+        -3: "Incorrect password",
+        -4: "Room is locked",
+    }.items()
+}
+UNKNOWN_ERROR_FRAME = codec.Frame({"type": "error", "message": "Unknown error"})
+
+# Optional protocol features a client can advertise with "features" in its join frame.
+# They are listed in the user objects of joined/gotjoined so peers can see them.
+# sdpz (dictionary compressed SDP, see client/sdpz.py) is end to end, the server only relays it.
+SDPZ = "sdpz"
+FEATURES = frozenset({ICE_BATCH, SDPZ})
+
+## A client whose websocket drops is kept in its room for RESUME_GRACE seconds.
+## It reconnects and sends {"type": "resume", "token": token} with the resume token
+## of its created/joined frame to get its membership back on the new websocket,
+## without the room ever seeing it leave. Tokens are only known to the process that
+## issued them: in worker mode a client resuming on another worker has its old
+## membership released by the issuing worker (see ClusterRegistry.release), is told
+## "Session not found" and joins again.
+sessions = {} # {resume token: Session}
+
+
+class Session:
+    """
+        State of one websocket client, handed to every message handler.
+        Its heartbeat and join timeout run on the server's timer wheel rather than
+        on per-socket timers, see timers.py. Sessions restored from a snapshot have
+        no connection until their client resumes them.
+    """
+    def __init__(self, conn, ip_addr):
+        self.conn=conn
+        self.ip=ip_addr
+        self.room=None # code of the joined room
+        self.name=None
+        self.features=frozenset()
+        self.sender_fields=None # from_ip/from_user members added to relayed frames, see codec.Members
+        self.ice=IceCoalescer(self)
+        self.token=None # resume token, see sessions
+        self.expiry=None # timer dropping the membership once the grace period of an offline session ends
+        self.silent=False # nothing received since the last ping
+        self.heartbeat=None
+        self.join_timeout=None
+
+    def start(self):
+        self.heartbeat=wheel.schedule(settings.HEARTBEAT, self._ping)
+        self.join_timeout=wheel.schedule(settings.JOIN_TIMEOUT, self._join_timed_out)
+
+    def joined(self, room_code, username, features, token=None):
+        self.room=room_code
+        self.name=username
+        self.features=features
+        self.sender_fields=codec.Members(from_ip=self.ip, from_user=username)
+        if self.conn is not None:
+            self.conn.features=features
+            self.join_timeout.cancel()
+        self._issue_token(token)
+
+    def resumed(self, previous):
+        """
+            Take over the membership of previous, the session of the same client on its
+            dropped websocket. The client keeps the address it joined with, whatever its
+            new one, since peers and relayed frames know it by that address.
+        """
+        if previous.expiry is not None:
+            previous.expiry.cancel()
+            previous.expiry=None
+        self.ip=previous.ip
+        self.room=previous.room
+        self.name=previous.name
+        self.sender_fields=previous.sender_fields
+        self.features=previous.features
+        self.conn.features=previous.features
+        previous.room=None # its handler has nothing left to clean up
+        self.join_timeout.cancel()
+        sessions.pop(previous.token, None)
+        self._issue_token() # a token is good for a single resume
+
+    def closed(self):
+        self.heartbeat.cancel()
+        self.join_timeout.cancel()
+
+    def _ping(self):
+        if self.conn.closed:
+            return
+        if self.silent:
+            logging.info("%s did not answer the last ping, closing its websocket", self.ip)
+            self.conn.timeout(b"heartbeat timeout")
+            return
+        self.silent=True
+        self.conn.ping()
+        self.heartbeat=wheel.schedule(settings.HEARTBEAT, self._ping)
+
+    def _join_timed_out(self):
+        if self.room is None and not self.conn.closed:
+            logging.info("%s did not join a room within %ss, closing its websocket", self.ip, settings.JOIN_TIMEOUT)
+            self.conn.timeout(b"join timeout")
+
+    def _issue_token(self, token=None):
+        sessions.pop(self.token, None)
+        self.token=token or rooms.session_token()
+        sessions[self.token]=self
+
+
+def parse_features(data) -> frozenset:
+    features = data.get("features")
+    if not isinstance(features, list):
+        return frozenset()
+    return FEATURES.intersection(f for f in features if isinstance(f, str))
+
+
+async def handle_join(session, data, raw, received_at):
+    if session.room is not None:
+        # Its first room would keep a member whose websocket is gone, online and never idle
+        session.conn.send(ERROR_FRAMES["Already in a room"])
+        return
+    room_code = data.get("room")
+    username = data.get("from")
+    password = data.get("password", "")
+    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    create = bool(data.get("create", False))
+    features = parse_features(data)
+    conn = session.conn
+
+    if create:
+        host_user = Users(username, session.ip, sorted(features))
+        try:
+            async with rooms.creating(room_code, password_hash, host_user, conn) as new_room:
+                if new_room is None:
+                    conn.send(ERROR_FRAMES["Room already exists"])
+                    return
+
+                session.joined(room_code, username, features)
+                logging.info("Room %s created by %s", room_code, username)
+                conn.send(codec.Frame({"type": "created", "room": room_code, "resume_token": session.token}))
+
+                host_user_info = new_room.getownerinfo()
+                host_conn = new_room.getconnection(host_user_info.getipaddr())
+                if host_conn and not host_conn.closed:
+                    host_conn.send(codec.Frame({
+                        "type": "gotcreated",
+                        "room": room_code,
+                        "user": host_user_info.toJSON()
+                    }))
+        except RoomLimitReached as e:
+            logging.warning("Room %s not created for %s: %s", room_code, session.ip, e)
+            conn.send(codec.Frame({"type": "error", "message": str(e)}))
+    else: # Join room
+        # Hold the room lock so the membership change and both notifications are atomic
+        async with rooms.locked(room_code) as room:
+            if not room:
+                conn.send(ERROR_FRAMES["Room not found"])
+                return
+
+            new_user = Users(username, session.ip, sorted(features))
+            join_status = await rooms.join(room, new_user, password_hash, conn)
+
+            if join_status == 1: # Success
+                session.joined(room_code, username, features)
+                host_user_info = room.getownerinfo()
+
+                logging.info("%s joined room %s", username, room_code)
+                conn.send(codec.Frame({
+                    "type": "joined",
+                    "room": room_code,
+                    "user": host_user_info.getname(),
+                    "clients": room.getotherclients(session.ip, json_encoder=userencoder),
+                    "resume_token": session.token
+                }))
+
+                host_conn = room.getconnection(host_user_info.getipaddr())
+                if host_conn and not host_conn.closed:
+                    host_conn.send(codec.Frame({
+                        "type": "gotjoined",
+                        "room": room_code,
+                        "user": new_user.toJSON()
+                    }))
+            else:
+                conn.send(JOIN_ERROR_FRAMES.get(join_status, UNKNOWN_ERROR_FRAME))
+
+
+async def handle_resume(session, data, raw, received_at):
+    """
+        {"type": "resume", "token": token} as the first frame of a new websocket. Answered
+        with a resumed frame holding the next resume token and the other members, or with
+        "Session not found" if the grace period is over and the client has to join again.
+    """
+    token = data.get("token")
+    previous = sessions.get(token) if isinstance(token, str) else None
+    if session.room or previous is None or previous.room is None:
+        if previous is None and not session.room and isinstance(token, str):
+            await rooms.release(token) # issued by another worker, free the username for the join that follows
+        session.conn.send(ERROR_FRAMES["Session not found"])
+        return
+    async with rooms.locked(previous.room) as room:
+        # the grace period may have ended while waiting for the lock
+        if not room or sessions.get(token) is not previous or previous.room is None:
+            session.conn.send(ERROR_FRAMES["Session not found"])
+            return
+        stale = room.getconnection(previous.ip) # the old websocket if its drop went unnoticed so far
+        session.resumed(previous)
+        rooms.attach(room, session.ip, session.conn)
+        logging.info("%s resumed its session in room %s", session.name, session.room)
+        session.conn.send(codec.Frame({
+            "type": "resumed",
+            "room": session.room,
+            "clients": room.getotherclients(session.ip, json_encoder=userencoder),
+            "resume_token": session.token
+        }))
+    if stale is not None and stale is not session.conn:
+        stale.supersede()
+
+
+async def went_offline(session):
+    """
+        The websocket of a member dropped: unbind it but keep the membership for
+        RESUME_GRACE seconds. The room only hears about it if the client does not resume.
+    """
+    async with rooms.locked(session.room) as room:
+        if not room or session.room is None: # room gone, or already resumed elsewhere
+            sessions.pop(session.token, None)
+            return
+        rooms.detach(room, session.ip)
+    logging.info("%s went offline in room %s, kept for %ss", session.name, session.room, settings.RESUME_GRACE)
+    await_resume(session)
+
+
+async def release_session(token):
+    """
+        Drop the member of a resume token for another worker, where its client reconnected.
+        It cannot resume there and joins again once the broker no longer lists it.
+    """
+    session = sessions.get(token)
+    if session is None or session.room is None:
+        return
+    if session.expiry is not None:
+        session.expiry.cancel()
+    conn = session.conn
+    await leave(session)
+    session.room = None # its handler has nothing left to clean up
+    if conn is not None and not conn.closed:
+        conn.supersede() # a half-open websocket the client has already replaced
+
+
+def await_resume(session):
+    session.expiry = wheel.schedule(settings.RESUME_GRACE, lambda: asyncio.create_task(leave(session)))
+
+
+async def leave(session):
+    """
+        Drop a member from its room for good and tell the others.
+    """
+    session.expiry = None
+    sessions.pop(session.token, None)
+    if session.room is None: # resumed in the meantime
+        return
+    async with rooms.locked(session.room) as room:
+        if room:
+            deleted = await rooms.drop(room, session.ip)
+            logging.info("%s with ip %s left room %s", session.name, session.ip, session.room)
+
+            if deleted:
+                logging.info("Room %s is empty and has been deleted.", session.room)
+            else:
+                # Notify remaining clients
+                broadcast(room.getconnections(), {
+                    "type": "user-left",
+                    "ip": session.ip,
+                    "user": session.name
+                })
+
+
+async def handle_message(session, data, raw, received_at):
+    room = rooms.get(session.room)
+    if not room:
+        return
+    sender = data.get("from", session.name)
+
+    # Create a properly formatted message, record() adds its room sequence number and id
+    message_payload = await rooms.record(room, {
+        "type": "message",
+        "text": data.get("text", ""),
+        "sender": sender,
+        "timestamp": time.strftime("%H:%M"),
+        "room": session.room
+    })
+    if message_payload is None:
+        return
+
+    # Broadcast message to all clients in the room (including sender)
+    relay_log.debug("Sending message %s from %s in room %s", message_payload["seq"], sender, session.room)
+    broadcast(room.getconnections(), message_payload, received_at=received_at)
+
+
+async def handle_history(session, data, raw, received_at):
+    """
+        {"type": "history", "after": seq}: every buffered message of the room with a
+        greater sequence number, in a single frame.
+    """
+    room = rooms.get(session.room)
+    after = data.get("after", 0)
+    if not room or type(after) is not int:
+        return
+    history = await rooms.replay(room, after)
+    if history is not None:
+        session.conn.send(codec.Frame({"type": "history", **history}))
+
+
+async def handle_relay(session, data, raw, received_at):
+    """
+        offer/answer/ice/bye: forward the frame as received with the sender fields spliced in,
+        so large SDP bodies are only re-encoded for recipients using another encoding.
+    """
+    room = rooms.get(session.room)
+    if not room:
+        return
+    session.ice.flush() # keep the order of this client's frames
+    frame = codec.Frame(data, session.sender_fields, raw)
+    target_ip = data.get("to_ip")
+
+    if target_ip:
+        target_conn = room.getconnection(target_ip)
+        if target_conn and not target_conn.closed:
+            relay_log.debug("Relaying %s from %s to %s in room %s", data["type"], session.name, target_ip, session.room)
+            target_conn.send(frame, received_at)
+    else: # Broadcast to all other clients if no target is specified
+        relay_log.debug("Broadcasting %s from %s in room %s", data["type"], session.name, session.room)
+        broadcast(room.getconnections(), frame, exclude=session.conn, received_at=received_at)
+
+
+async def handle_ice(session, data, raw, received_at):
+    """
+        Candidates for a recipient that supports ice-batch are coalesced, see coalesce.py.
+        Everything else is relayed as a single frame.
+    """
+    room = rooms.get(session.room)
+    target_ip = data.get("to_ip")
+    if room and target_ip and settings.ICE_BATCH_WINDOW > 0:
+        target_conn = room.getconnection(target_ip)
+        if target_conn and accepts_batches(target_conn):
+            if not target_conn.closed:
+                session.ice.add(target_conn, data.get("candidate"), received_at)
+            return
+    await handle_relay(session, data, raw, received_at)
+
+
+async def handle_ice_batch(session, data, raw, received_at):
+    """
+        A client that batches its own candidates. Recipients without ice-batch support
+        get one ice frame per candidate instead.
+    """
+    room = rooms.get(session.room)
+    candidates = data.get("candidates")
+    if not room or not isinstance(candidates, list):
+        return
+    session.ice.flush()
+    target_ip = data.get("to_ip")
+    if target_ip:
+        target_conn = room.getconnection(target_ip)
+        recipients = [target_conn] if target_conn else []
+    else:
+        recipients = [conn for conn in room.getconnections() if conn is not session.conn]
+
+    batch = None
+    singles = None
+    for conn in recipients:
+        if conn.closed:
+            continue
+        if accepts_batches(conn):
+            batch = batch or codec.Frame(data, session.sender_fields, raw)
+            conn.send(batch, received_at)
+        else:
+            if singles is None:
+                fields = {key: value for key, value in data.items() if key != "candidates"}
+                singles = [
+                    codec.Frame(dict(fields, type="ice", candidate=candidate), session.sender_fields)
+                    for candidate in candidates
+                ]
+            for frame in singles:
+                conn.send(frame, received_at)
+
+
+def rate_limited(session, message_type, now) -> float:
+    """
+        Charge a frame to the sender's address and to its room.
+        Returns 0 if it may be handled, otherwise the seconds the sender should wait.
+    """
+    retry_after = ip_limits.check(session.ip, message_type, now)
+    if not retry_after and session.room:
+        retry_after = room_limits.check(session.room, message_type, now)
+    return retry_after
+
+
+HANDLERS = {
+    "join": handle_join,
+    "message": handle_message,
+    "history": handle_history,
+    "resume": handle_resume,
+    "offer": handle_relay,
+    "answer": handle_relay,
+    "ice": handle_ice,
+    "ice-batch": handle_ice_batch,
+    "bye": handle_relay,
+}
 
-rooms = {} # This will now store Rooms objects
 
 @routes.get('/ws')
 async def websocket_handler(request):
+    # Admitted before the upgrade, so a client turned away gets a plain 503 with Retry-After
+    try:
+        await admission.acquire()
+    except AdmissionRejected as e:
+        metrics.ADMISSION_REJECTED.inc()
+        logging.warning("Websocket from %s turned away: %s", request.headers.get("X-Forwarded-For") or request.remote, e)
+        return web.Response(status=503, text=str(e), headers={"Retry-After": str(e.retry_after)})
+    try:
+        return await serve_websocket(request)
+    finally:
+        admission.release()
+
+
+async def serve_websocket(request):
     # Create WebSocket response with proper configuration
-    ws = web.WebSocketResponse(autoping=True, heartbeat=30)
-    
+    # The subprotocol picks the encoding of the frames sent to this client, see codec.py
+    # Pings and pongs are handled below and the heartbeat runs on the timer wheel (Session._ping)
+    ws = web.WebSocketResponse(autoping=False, protocols=codec.PROTOCOLS, compress=settings.WS_COMPRESS)
+
     # Prepare the WebSocket connection
     # This handles the handshake properly for both browser and Electron clients
     await ws.prepare(request)
 
-    current_room = None
-    current_name = None
     ip_addr = request.headers.get("X-Forwarded-For") or request.remote
 
+    # Every frame to this client goes through its outbox, see broadcast.py
+    conn = Connection(ws, ip_addr, encoding=codec.encoding_of(ws.ws_protocol))
+    conn.start()
+    session = Session(conn, ip_addr)
+    session.start()
+    connections.add(conn)
+    metrics.OPEN_WEBSOCKETS.inc()
+
     try:
         async for msg in ws:
-            if msg.type == web.WSMsgType.TEXT:
+            session.silent = False
+            if msg.type in (web.WSMsgType.TEXT, web.WSMsgType.BINARY):
+                # Text frames carry JSON and binary frames MessagePack, whatever was negotiated
+                received_at = time.perf_counter()
+                metrics.PAYLOAD_SIZE.observe(len(msg.data))
                 try:
-                    data = json.loads(msg.data)
-                except Exception as e:
-                    logging.warning("Invalid JSON: %s", e)
+                    data = codec.loads(msg.data) if msg.type == web.WSMsgType.TEXT else codec.unpack(msg.data)
+                except ValueError as e:
+                    logging.warning("Invalid frame: %s", e)
+                    continue
+                if not isinstance(data, dict):
+                    logging.warning("Invalid frame: expected an object")
                     continue
 
                 t = data.get("type")
-                if t == "join":
-                    room_code = data.get("room")
-                    username = data.get("from")
-                    password = data.get("password", "")
-                    password_hash = hashlib.sha256(password.encode()).hexdigest()
-                    create = bool(data.get("create", False))
-                    
-                    ip_addr = request.headers.get("X-Forwarded-For") or request.remote
-
-                    if create:
-                        if room_code in rooms:
-                            await ws.send_str(json.dumps({"type": "error", "message": "Room already exists"}))
-                            continue
-                        
-                        host_user = Users(username, ip_addr)
-                        new_room = Rooms(room_code, password_hash, host_user)
-                        new_room.websockets[ip_addr] = ws
-                        rooms[room_code] = new_room
-                        
-                        current_room = room_code
-                        current_name = username
-                        logging.info(f"Room {room_code} created by {username}")
-                        await ws.send_str(json.dumps({"type": "created", "room": room_code}))
-                        
-                        host_user_info = new_room.getownerinfo()
-                        host_ws = new_room.websockets.get(host_user_info.getipaddr())
-                        if host_ws and not host_ws.closed:
-                            await host_ws.send_str(json.dumps({
-                                "type": "gotcreated",
-                                "room": room_code,
-                                "user": host_user_info.toJSON()
-                            }))
-                    else: # Join room
-                        room = rooms.get(room_code)
-                        if not room:
-                            await ws.send_str(json.dumps({"type": "error", "message": "Room not found"}))
-                            continue
-                        
-                        new_user = Users(username, ip_addr)
-                        join_status = room.addclient(new_user, password_hash)
-
-                        if join_status == 1: # Success
-                            room.websockets[ip_addr] = ws
-                            current_room = room_code
-                            current_name = username
-                            host_user_info = room.getownerinfo()
-
-                            logging.info(f"{username} joined room {room_code}")
-                            await ws.send_str(json.dumps({
-                                "type": "joined",
-                                "room": room_code,
-                                "user": host_user_info.getname(),
-                                "clients": room.getotherclients(ip_addr, json_encoder=userencoder)
-                            }))
-                            
-                            host_ws = room.websockets.get(host_user_info.getipaddr())
-                            if host_ws and not host_ws.closed:
-                                await host_ws.send_str(json.dumps({
-                                    "type": "gotjoined",
-                                    "room": room_code,
-                                    "user": new_user.toJSON()
-                                }))
-                        else:
-                            error_messages = {
-                                -1: "Username not available",
-                                -2: "IP address already in use",
-                                -3: "Incorrect password",
-                                -4: "Room is locked"
-                            }
-                            await ws.send_str(json.dumps({"type": "error", "message": error_messages.get(join_status, "Unknown error")}))
-
-                elif t == "message":
-                    if current_room and current_room in rooms:
-                        room = rooms[current_room]
-                        message_text = data.get("text", "")
-                        sender = data.get("from", current_name)
-                        
-                        # Create a properly formatted message
-                        import time
-                        message_payload = {
-                            "type": "message",
-                            "id": f"{current_room}_{ip_addr}_{int(time.time() * 1000)}",
-                            "text": message_text,
-                            "sender": sender,
-                            "timestamp": time.strftime("%H:%M"),
-                            "room": current_room
-                        }
-                        
-                        # Broadcast message to all clients in the room (including sender)
-                        for client_ip, client_ws in room.websockets.items():
-                            if not client_ws.closed:
-                                logging.info(f"Sending message from {sender} to {client_ip} in room {current_room}")
-                                await client_ws.send_str(json.dumps(message_payload))
-                
-                elif t in ("offer", "answer", "ice", "bye"):
-                    if current_room and current_room in rooms:
-                        room = rooms[current_room]
-                        target_ip = data.get("to_ip")
-                        
-                        if target_ip:
-                            target_ws = room.websockets.get(target_ip)
-                            if target_ws and not target_ws.closed:
-                                payload = dict(data)
-                                payload["from_ip"] = ip_addr
-                                payload["from_user"] = current_name
-                                logging.info(f"Relaying {t} from {current_name} to {target_ip} in room {current_room}")
-                                await target_ws.send_str(json.dumps(payload))
-                        else: # Broadcast to all other clients if no target is specified
-                            for client_ip, client_ws in room.websockets.items():
-                                if client_ip != ip_addr and not client_ws.closed:
-                                    payload = dict(data)
-                                    payload["from_ip"] = ip_addr
-                                    payload["from_user"] = current_name
-                                    logging.info(f"Broadcasting {t} from {current_name} to {client_ip} in room {current_room}")
-                                    await client_ws.send_str(json.dumps(payload))
-                else:
+                handler = HANDLERS.get(t) if isinstance(t, str) else None
+                metrics.MESSAGES.inc(t if handler else "other")
+                if handler is None:
                     logging.warning("Unknown message type: %s", t)
+                    continue
+                # Checked before the handler so a flood never reaches the hashing or the fan out
+                retry_after = rate_limited(session, t, received_at)
+                if retry_after:
+                    metrics.RATE_LIMITED.inc(t)
+                    conn.send(codec.Frame({
+                        "type": "error",
+                        "message": "Rate limit exceeded",
+                        "request": t,
+                        "retry_after": round(retry_after, 3)
+                    }))
+                    continue
+                try:
+                    await handler(session, data, msg.data, received_at)
+                except RegistryUnavailable as e:
+                    logging.error("Cannot handle a %s frame from %s: %s", t, session.ip, e)
+                    conn.send(ERROR_FRAMES["Server unavailable"])
+                except Exception:
+                    # A frame the handler chokes on is dropped, the websocket stays open
+                    logging.exception("Failed to handle a %s frame from %s", t, session.ip)
+
+            elif msg.type == web.WSMsgType.PING:
+                await ws.pong(msg.data)
 
             elif msg.type == web.WSMsgType.ERROR:
                 logging.error('ws connection closed with exception %s', ws.exception())
 
     finally:
-        if current_room and current_room in rooms:
-            room = rooms[current_room]
-            room.dropclient(ip_addr)
-            room.websockets.pop(ip_addr, None)
-            logging.info(f"{current_name} with ip {ip_addr} left room {current_room}")
-
-            if room.getclientnos() == 0:
-                del rooms[current_room]
-                logging.info(f"Room {current_room} is empty and has been deleted.")
+        connections.discard(conn)
+        metrics.OPEN_WEBSOCKETS.dec()
+        session.closed()
+        session.ice.flush()
+        await conn.close()
+        if session.room:
+            # A client closing its websocket on purpose leaves, a dropped one may come back
+            dropped = conn.timed_out or ws.close_code not in (WSCloseCode.OK, WSCloseCode.GOING_AWAY)
+            if settings.RESUME_GRACE > 0 and dropped:
+                await went_offline(session)
             else:
-                # Notify remaining clients
-                for client_ip, client_ws in room.websockets.items():
-                    if not client_ws.closed:
-                        await client_ws.send_str(json.dumps({
-                            "type": "user-left",
-                            "ip": ip_addr,
-                            "user": current_name
-                        }))
+                await leave(session)
 
     return ws
 
@@ -191,31 +567,266 @@ async def create_room_http(request: web.Request):
     if not all([room_code, username, peer_ip]):
         return web.json_response({"error": "Missing required parameters"}, status=400)
 
-    if room_code in rooms:
-        return web.json_response({"error": "Room already exists"}, status=409)
-
     # Use a dummy password for HTTP creation for now
     password_hash = hashlib.sha256("".encode()).hexdigest()
     host_user = Users(username, peer_ip)
-    new_room = Rooms(room_code, password_hash, host_user)
-    rooms[room_code] = new_room
+    # peer_ip is chosen by the caller, charge the room to the address the request came from
+    creator = request.headers.get("X-Forwarded-For") or request.remote
+    try:
+        async with rooms.creating(room_code, password_hash, host_user, creator=creator) as new_room:
+            if new_room is None:
+                return web.json_response({"error": "Room already exists"}, status=409)
+    except RoomLimitReached as e:
+        logging.warning("Room %s not created via HTTP for %s: %s", room_code, creator, e)
+        status = 429 if e.scope == "address" else 503
+        return web.json_response({"error": str(e)}, status=status)
+    except RegistryUnavailable as e:
+        logging.error("Room %s not created via HTTP for %s: %s", room_code, creator, e)
+        return web.json_response({"error": "Server unavailable"}, status=503)
 
-    logging.info(f"Room {room_code} created via HTTP by {username}")
+    logging.info("Room %s created via HTTP by %s", room_code, username)
     
     # The test script expects a specific status message format
     status_message = f"ROOM_CREATED with {peer_ip}:{5000}" # Assuming a default port
     return web.json_response({"status": status_message})
 
 
+event_streams = {} # {address: open /room/{room_code}/events streams}
+
+
+def may_watch(request: web.Request, room_code, room) -> bool:
+    """
+        Whether an events request may see the members of room: it holds the room password
+        (X-Room-Password header, none for a room without password) or the resume token of
+        one of its members (Authorization: Bearer <token>, only known to the issuing worker).
+    """
+    password = request.headers.get("X-Room-Password", "")
+    if room.matchpassword(hashlib.sha256(password.encode()).hexdigest()):
+        return True
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    session = sessions.get(token) if scheme == "Bearer" else None
+    return session is not None and session.room == room_code
+
+
+@routes.get('/room/{room_code}/events')
+async def room_events(request: web.Request):
+    """
+        Server-sent events for the membership of a room: "members" with the current
+        member list first, then "join", "leave", and "closed" once the room is gone.
+        Members carry their address, so only clients that could join the room may
+        subscribe, see may_watch.
+    """
+    room_code = request.match_info["room_code"]
+    address = request.headers.get("X-Forwarded-For") or request.remote
+    retry_after = ip_limits.check(address, "events", time.perf_counter())
+    if retry_after:
+        return web.json_response({"error": "Rate limit exceeded"}, status=429, headers={"Retry-After": str(math.ceil(retry_after))})
+    if event_streams.get(address, 0) >= settings.SSE_MAX_PER_IP:
+        return web.json_response({"error": "Too many event streams"}, status=429)
+    room = rooms.get(room_code)
+    if room is None:
+        return web.json_response({"error": "Room not found"}, status=404)
+    if not may_watch(request, room_code, room):
+        return web.json_response({"error": "Forbidden"}, status=403)
+
+    event_streams[address] = event_streams.get(address, 0) + 1
+    try:
+        return await stream_events(request, room_code, room)
+    finally:
+        event_streams[address] -= 1
+        if not event_streams[address]:
+            del event_streams[address]
+
+
+async def stream_events(request: web.Request, room_code, room):
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # keep reverse proxies from buffering the stream
+    })
+    await response.prepare(request)
+    with rooms.events.subscribe(room_code) as subscription:
+        try:
+            if rooms.get(room_code) is not room:
+                # Deleted, or deleted and created again, while the headers were sent: its close was missed
+                await response.write(events.sse("closed", {"room": room_code}))
+                return response
+            await response.write(events.sse("members", {
+                "room": room_code,
+                "users": room.getotherclients(None, json_encoder=userencoder)
+            }))
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscription.get(), settings.SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if frame is None:
+                    break
+                await response.write(frame)
+        except ConnectionResetError:
+            pass
+    return response
+
+
+@routes.get('/metrics')
+async def metrics_handler(request: web.Request):
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+def prune_limits(timers):
+    """
+        Forget rate limit buckets that are full again, every LIMITS_PRUNE_INTERVAL seconds.
+    """
+    now = time.perf_counter()
+    ip_limits.prune(now)
+    room_limits.prune(now)
+    timers["prune"] = wheel.schedule(settings.LIMITS_PRUNE_INTERVAL, prune_limits, timers)
+
+
+async def timer_wheel(app):
+    """
+        Run the timer wheel behind heartbeats, timeouts and room TTLs for the lifetime of the app.
+    """
+    timers = {} # {name: pending Timer} of the timers that reschedule themselves
+    timers["prune"] = wheel.schedule(settings.LIMITS_PRUNE_INTERVAL, prune_limits, timers)
+    task = asyncio.create_task(wheel.run())
+    yield
+    timers["prune"].cancel()
+    task.cancel()
+
+
+## Saves run one at a time. Once shutdown has taken the last snapshot the periodic
+## save stops, members leaving as their websockets close must not overwrite it.
+saving = asyncio.Lock()
+stopping = asyncio.Event()
+
+
+def capture_rooms() -> dict:
+    members = [
+        (token, session.room, Users(session.name, session.ip, sorted(session.features)))
+        for token, session in sessions.items() if session.room is not None
+    ]
+    return snapshot.capture(rooms, members)
+
+
+async def save_rooms():
+    data = capture_rooms()
+    await asyncio.get_running_loop().run_in_executor(None, snapshot.save, settings.SNAPSHOT_FILE, data)
+    return data
+
+
+async def periodic_save():
+    async with saving:
+        if stopping.is_set():
+            return
+        try:
+            await save_rooms()
+        except OSError as e:
+            logging.error("Saving the room snapshot to %s failed: %s", settings.SNAPSHOT_FILE, e)
+
+
+def restore_rooms(data):
+    """
+        Recreate the rooms of a snapshot and the sessions their members can resume.
+    """
+    for entry in data["rooms"]:
+        owner = Users(entry["owner"]["username"], entry["owner"]["ip"], entry["owner"].get("features", ()))
+        members = [Users(user["username"], user["ip"], user.get("features", ())) for user in entry["members"]]
+        rooms.restore(entry["code"], entry["password"], owner, members, entry["locked"], entry["creator"],
+                      entry.get("owner_present", True))
+    for entry in data["sessions"]:
+        user = entry["user"]
+        room = rooms.get(entry["room"])
+        if room is None or room.getclient(user["ip"]) is None:
+            continue
+        session = Session(None, user["ip"])
+        session.joined(entry["room"], user["username"], FEATURES.intersection(user.get("features", ())), entry["token"])
+        await_resume(session)
+
+
+def snapshot_rooms(timers):
+    """
+        Save the rooms every SNAPSHOT_INTERVAL seconds.
+    """
+    asyncio.create_task(periodic_save())
+    timers["snapshot"] = wheel.schedule(settings.SNAPSHOT_INTERVAL, snapshot_rooms, timers)
+
+
+async def warm_restart(app):
+    """
+        Restore the rooms saved by the previous run and keep saving them, single process only.
+    """
+    if not settings.SNAPSHOT_FILE or not rooms.persistent:
+        yield
+        return
+    start = time.perf_counter()
+    data = await asyncio.get_running_loop().run_in_executor(None, snapshot.load, settings.SNAPSHOT_FILE, settings.ROOM_IDLE_TTL)
+    if data is not None:
+        restore_rooms(data)
+        logging.info("Restored %d rooms and %d sessions from %s in %.0f ms", len(data["rooms"]), len(data["sessions"]),
+                     settings.SNAPSHOT_FILE, (time.perf_counter() - start) * 1e3)
+    timers = {}
+    timers["snapshot"] = wheel.schedule(settings.SNAPSHOT_INTERVAL, snapshot_rooms, timers)
+    yield
+    timers["snapshot"].cancel()
+
+
+async def shutdown(app):
+    """
+        Save the rooms while every member is still connected, then close the websockets
+        so clients reconnect and resume into the next run.
+    """
+    stopping.set()
+    if settings.SNAPSHOT_FILE and rooms.persistent:
+        async with saving: # waits for a periodic save in progress
+            data = await save_rooms()
+        logging.info("Saved %d rooms to %s", len(data["rooms"]), settings.SNAPSHOT_FILE)
+    await asyncio.gather(*(
+        conn.ws.close(code=WSCloseCode.GOING_AWAY, message=b"server restarting") for conn in list(connections)
+    ), return_exceptions=True)
+
+
 async def index(request: web.Request):
-    return web.FileResponse(INDEX_FILE)
+    return index_page.response(request)
+
+
+async def static_file(request: web.Request):
+    asset = static_files.get(request.match_info["path"])
+    if asset is None:
+        raise web.HTTPNotFound()
+    return asset.response(request)
 
 
 app = web.Application()
 app.add_routes(routes)
-# app.router.add_static('/static/', path='static', name='static')  # Commented out - static directory doesn't exist
+app.cleanup_ctx.append(timer_wheel)
+app.cleanup_ctx.append(warm_restart)
+app.on_shutdown.append(shutdown)
 app.router.add_get("/", index)
+app.router.add_get("/static/{path:.+}", static_file)
 app.router.add_get("/ws", websocket_handler)
 
+def use_registry(registry):
+    """
+        Replace the room registry, used by worker processes in cluster mode.
+    """
+    global rooms
+    rooms = registry
+    registry.on_release = release_session
+    return app
+
+
 if __name__ == '__main__':
-    web.run_app(app, host="0.0.0.0", port=5001)
+    parser = argparse.ArgumentParser(description="Cryptic signaling server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=settings.WORKERS, help="number of processes sharing the port")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        import cluster
+        cluster.serve(args.workers, args.host, args.port, use_registry)
+    else:
+        setup_logging()
+        web.run_app(app, host=args.host, port=args.port)
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+## Room metadata saved to a local file, periodically and on shutdown, and loaded
+## on startup so a restart keeps every room. A snapshot holds the rooms (code,
+## password hash, owner and whether it is still a member, members, lock state,
+## creator) and the resume tokens of
+## their members, so clients reconnecting after the restart resume their session
+## instead of recreating rooms. Restored members are offline until they resume.
+## Chat history and connections are not saved.
+##
+## The file holds resume tokens and is only readable by the server user: keep it
+## in a directory only the server user can write. It is written to a temporary file
+## of its own, created next to it, that replaces the old one, so a crash while
+## saving leaves the previous snapshot intact. A snapshot not owned by the server
+## user, or writable by others, is not loaded, and entries that do not have the
+## expected shape are skipped.
+
+VERSION = 1
+
+def capture(registry, sessions) -> dict:
+    """
+        Snapshot of every room of registry. sessions are the (token, room_code, user)
+        of the members that may resume.
+    """
+    rooms = []
+    for room_code, room in registry.items():
+        owner = room.getownerinfo()
+        rooms.append({
+            "code": room_code,
+            "password": room.getpassword(),
+            "owner": owner.toJSON(),
+            "owner_present": room.getclient(owner.getipaddr()) is owner, # the owner may have left its room
+            "members": [user.toJSON() for user in room.getmembers() if user is not owner],
+            "locked": room.islocked(),
+            "creator": registry.creator_of(room_code),
+        })
+    return {
+        "version": VERSION,
+        "saved_at": time.time(),
+        "rooms": rooms,
+        "sessions": [{"token": token, "room": room_code, "user": user.toJSON()} for token, room_code, user in sessions],
+    }
+
+def save(path, snapshot:dict):
+    """
+        Write a snapshot atomically. Blocking, run it in an executor.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory) # mode 0600, never an existing file
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def load(path, max_age) -> dict:
+    """
+        The snapshot saved at path, None if there is none, it cannot be read or it is
+        older than max_age seconds (its rooms would have expired anyway).
+    """
+    try:
+        with open(path) as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_uid != os.geteuid() or stat.st_mode & 0o022:
+                logging.warning("Ignoring snapshot %s: not owned by the server user or writable by others", path)
+                return None
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != VERSION:
+        logging.warning("Ignoring snapshot %s of an unknown version", path)
+        return None
+    saved_at = snapshot.get("saved_at")
+    if not isinstance(saved_at, (int, float)) or time.time() - saved_at > max_age:
+        logging.info("Ignoring snapshot %s saved at %s", path, saved_at)
+        return None
+    rooms = _entries(snapshot.get("rooms"), _valid_room)
+    sessions = _entries(snapshot.get("sessions"), _valid_session)
+    skipped = len(snapshot.get("rooms") or ()) - len(rooms) + len(snapshot.get("sessions") or ()) - len(sessions)
+    if skipped:
+        logging.warning("Skipped %d malformed entries of snapshot %s", skipped, path)
+    return {**snapshot, "rooms": rooms, "sessions": sessions}
+
+def _entries(entries, valid) -> list:
+    if not isinstance(entries, list):
+        return []
+    return [entry for entry in entries if isinstance(entry, dict) and valid(entry)]
+
+def _valid_user(user) -> bool:
+    return (isinstance(user, dict) and isinstance(user.get("username"), str) and isinstance(user.get("ip"), str)
+            and isinstance(user.get("features", []), list) and all(isinstance(f, str) for f in user.get("features", [])))
+
+def _valid_room(entry) -> bool:
+    members = entry.get("members")
+    return (isinstance(entry.get("code"), str) and isinstance(entry.get("password"), str)
+            and _valid_user(entry.get("owner")) and isinstance(entry.get("owner_present", True), bool)
+            and isinstance(members, list) and all(_valid_user(user) for user in members)
+            and isinstance(entry.get("locked"), bool) and isinstance(entry.get("creator"), (str, type(None))))
+
+def _valid_session(entry) -> bool:
+    return isinstance(entry.get("token"), str) and isinstance(entry.get("room"), str) and _valid_user(entry.get("user"))
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+import settings
+
+## Hierarchical timer wheel shared by the whole server. Heartbeats, join timeouts,
+## resume grace periods and room TTLs are all long (seconds) and rarely precise, so
+## instead of one event loop callback per connection and per timer they go into
+## the slots of a wheel that a single task advances once per tick. Everything due
+## in a tick runs in one batch.
+##
+## Level 0 has one slot per tick, every slot of level n spans a full turn of level
+## n - 1. A timer goes to the lowest level on which it is in the current turn and
+## moves down a level each time the slot it sits in comes up (the cascade), so
+## scheduling and cancelling are O(1) whatever the number of pending timers.
+
+class Timer:
+    """
+        A scheduled callback. cancel() is O(1): the timer stays in its slot and is
+        skipped when the slot comes up.
+    """
+    __slots__ = ("expires", "callback", "args", "cancelled")
+
+    def __init__(self, expires, callback, args):
+        self.expires=expires # tick
+        self.callback=callback
+        self.args=args
+        self.cancelled=False
+
+    def cancel(self):
+        self.cancelled=True
+
+class TimerWheel:
+    """
+        Timers with a resolution of tick seconds. A timer never fires early and at
+        most one tick late. slots must be a power of two, the wheel covers
+        tick * slots ** levels seconds, later timers wait in an overflow list.
+    """
+    def __init__(self, tick=1.0, slots=64, levels=4, clock=time.monotonic):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.tick=tick
+        self.clock=clock
+        self._bits=slots.bit_length() - 1
+        self._mask=slots - 1
+        self._levels=[[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow=[]
+        self._current=int(clock() / tick) # last tick processed
+        self._pending=0 # timers in the wheel, cancelled ones included until their slot comes up
+
+    def __len__(self):
+        return self._pending
+
+    def schedule(self, delay, callback, *args) -> Timer:
+        """
+            Call callback(*args) in delay seconds, from the task running the wheel.
+        """
+        expires = max(self._current + 1, -int(-(self.clock() + delay) // self.tick))
+        timer = Timer(expires, callback, args)
+        self._insert(timer)
+        self._pending += 1
+        return timer
+
+    def _insert(self, timer):
+        for level, slots in enumerate(self._levels):
+            shift = self._bits * level
+            # same turn of the level above: the timer belongs to this level
+            if timer.expires >> (shift + self._bits) == self._current >> (shift + self._bits):
+                slots[(timer.expires >> shift) & self._mask].append(timer)
+                return
+        self._overflow.append(timer)
+
+    def _cascade(self, timers):
+        for timer in timers:
+            if timer.cancelled:
+                self._pending -= 1
+            else:
+                self._insert(timer)
+
+    def advance(self, now=None) -> int:
+        """
+            Run every timer due at now. Returns the number of callbacks run.
+        """
+        now = self.clock() if now is None else now
+        target = int(now / self.tick)
+        fired = 0
+        while self._current < target:
+            self._current += 1
+            tick = self._current
+            # higher levels first, their timers may land in a lower slot that cascades next
+            if tick & ((1 << (self._bits * len(self._levels))) - 1) == 0:
+                overflow, self._overflow = self._overflow, []
+                self._cascade(overflow)
+            for level in range(len(self._levels) - 1, 0, -1):
+                shift = self._bits * level
+                if tick & ((1 << shift) - 1) == 0:
+                    slots = self._levels[level]
+                    index = (tick >> shift) & self._mask
+                    timers, slots[index] = slots[index], []
+                    self._cascade(timers)
+            slots = self._levels[0]
+            timers, slots[tick & self._mask] = slots[tick & self._mask], []
+            self._pending -= len(timers)
+            for timer in timers:
+                if timer.cancelled:
+                    continue
+                fired += 1
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logging.exception("Timer callback %r failed", timer.callback)
+        return fired
+
+    async def run(self):
+        """
+            Advance the wheel every tick until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+wheel = TimerWheel(settings.TIMER_TICK) # the server's wheel, run by the app (see signaling_server.py)
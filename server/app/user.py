@@ -1,11 +1,26 @@
+import sys
+
+def intern(value):
+    """
+        Intern identifiers so every room, index and frame holding the same username,
+        address or room code shares one string. Anything but a str is returned as is.
+    """
+    return sys.intern(value) if type(value) is str else value
+
 class Users:
     """
         Users class represents an user connected to a particular room.
         Users are identifiable with their unique public ip and the username in the room.
+        A Users object is also the entry of its room's membership table, so it carries
+        the member's connection.
     """
-    def __init__(self, username, ipaddr):
-        self._username=username
-        self._ipaddr=ipaddr
+    __slots__ = ("_username", "_ipaddr", "_features", "conn")
+
+    def __init__(self, username, ipaddr, features=()):
+        self._username=intern(username)
+        self._ipaddr=intern(ipaddr)
+        self._features=tuple(features) # optional protocol features, shown to the other members
+        self.conn=None # Connection of the member in its room, None while offline, see Rooms.setconnection
 
     def getname(self):
         return self._username
@@ -13,23 +28,26 @@ class Users:
     def getipaddr(self):
         return self._ipaddr
 
+    def getfeatures(self):
+        return self._features
+
     def isnameequal(self, name):
         return self._username==name
 
     def toJSON(self):
-        return {
+        user = {
                 "username": self._username,
                 "ip": self._ipaddr
         }
+        if self._features:
+            user["features"] = list(self._features)
+        return user
 
 def userencoder(obj):
     """
         Default encoder for the Class Users class
     """
     if isinstance(obj, Users):
-        return {
-            "username": obj.getname(), 
-            "ip": obj.getipaddr()
-        }
+        return obj.toJSON()
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
@@ -0,0 +1,99 @@
+"""
+Bytes on the wire and encode/parse time per handshake for each signaling encoding.
+
+A handshake is the frames of one guest joining a room and negotiating with the
+host: join, joined, gotjoined, offer and answer with a realistic SDP, the PEM
+public key and the wrapped Fernet key, then --ice candidates in each direction.
+Every frame is encoded by its sender, parsed by the server, relayed with the
+sender fields spliced in (codec.Frame) and parsed again by the recipient.
+
+    python server/bench/bench_encoding.py --ice 8
+
+MessagePack is only measured when msgpack is installed, orjson only when orjson is.
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from loadgen import PUBKEY, SDP # also puts server/app on sys.path
+import codec
+
+HOST = {"username": "host", "ip": "10.0.0.1"}
+GUEST = {"username": "guest", "ip": "10.0.0.2"}
+FERNET_KEY = base64.b64encode(os.urandom(256)).decode("ascii") # RSA-2048 OAEP ciphertext
+
+def handshake(ice):
+    """
+        (frame sent by a client, frame the server sends on, sender fields the server adds)
+        for every frame of one handshake. Frames the server creates have no client frame.
+    """
+    frames = [
+        ({"type": "join", "room": "ROOM01", "from": "guest", "password": "", "create": False}, None, None),
+        (None, {"type": "joined", "room": "ROOM01", "user": "host", "clients": [HOST]}, None),
+        (None, {"type": "gotjoined", "room": "ROOM01", "user": GUEST}, None),
+        ({"type": "offer", "room": "ROOM01", "from": "host", "to": "guest", "to_ip": GUEST["ip"],
+          "sdp": SDP, "sdpType": "offer", "pubKey": PUBKEY}, None, HOST),
+        ({"type": "answer", "room": "ROOM01", "from": "guest", "to": "host", "to_ip": HOST["ip"],
+          "sdp": SDP, "sdpType": "answer", "fernetKey": FERNET_KEY}, None, GUEST),
+    ]
+    for i in range(ice):
+        for sender, recipient in ((HOST, GUEST), (GUEST, HOST)):
+            candidate = {"candidate": f"candidate:{i} 1 udp 2130706431 192.168.1.{i} {50000 + i} typ host", "sdpMid": "0", "sdpMLineIndex": 0}
+            frames.append(({"type": "ice", "to_ip": recipient["ip"], "candidate": candidate}, None, sender))
+    return frames
+
+def codecs():
+    found = {"json (stdlib)": (json.dumps, json.loads)}
+    if codec.orjson is not None:
+        found["json (orjson)"] = (codec.dumps, codec.loads)
+    if codec.msgpack is not None:
+        found["msgpack"] = (codec.pack, codec.unpack)
+    return found
+
+def measure(encoder, decoder, frames, repeat):
+    """
+        Returns (bytes, encode seconds, parse seconds) for one handshake.
+    """
+    # the server encodes the sender fields once per session
+    members = {user["ip"]: codec.Members(from_ip=user["ip"], from_user=user["username"]) for user in (HOST, GUEST)}
+    size = 0
+    encode_time = parse_time = 0.0
+    for _ in range(repeat):
+        size = 0
+        for sent, created, sender in frames:
+            start = time.perf_counter()
+            if sent is not None:
+                raw = encoder(sent)
+                encode_time += time.perf_counter() - start
+                size += len(raw)
+                start = time.perf_counter()
+                decoder(raw) # server
+                parse_time += time.perf_counter() - start
+                start = time.perf_counter()
+                out = codec.splice(raw, members[sender["ip"]]) if sender else encoder(sent)
+            else:
+                out = encoder(created)
+            encode_time += time.perf_counter() - start
+            size += len(out)
+            start = time.perf_counter()
+            decoder(out) # recipient
+            parse_time += time.perf_counter() - start
+    return size, encode_time / repeat, parse_time / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ice", type=int, default=8, help="ICE candidates sent by each side")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    frames = handshake(args.ice)
+    print(f"{len(frames)} frames per handshake, {args.ice} ICE candidates each way")
+    print(f"{'encoding':<16}{'bytes':>10}{'encode us':>12}{'parse us':>12}")
+    for name, (encoder, decoder) in codecs().items():
+        size, encode_time, parse_time = measure(encoder, decoder, frames, args.repeat)
+        print(f"{name:<16}{size:>10}{encode_time * 1e6:>12.1f}{parse_time * 1e6:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Relay throughput of the signaling server with the per-frame relay log off,
+on through the queue-backed pipeline (logsetup.py), and on with a plain
+synchronous StreamHandler, the way the server logged before.
+
+    python server/bench/bench_logging.py --frames 20000 --peers 8
+
+The app runs in-process on an aiohttp test server. Log output goes to a
+temporary file so the numbers do not depend on the terminal; --stall-us makes
+every write to it block for that long, like stderr piped to a busy reader.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from aiohttp import WSMsgType
+from aiohttp.test_utils import TestClient, TestServer
+import logsetup
+import settings
+import signaling_server
+
+HOST_IP = "10.0.0.1"
+# off: relay log disabled, async: every frame through the queue, sampled: 1 in 100 through the queue,
+# sync: every frame written by a StreamHandler on the event loop
+MODES = ("off", "async", "sampled", "sync")
+
+async def relay_throughput(frames, peers):
+    """
+        Peers send offers to the host, returns frames relayed per second.
+    """
+    async with TestClient(TestServer(signaling_server.app)) as client:
+        host = await client.ws_connect("/ws", headers={"X-Forwarded-For": HOST_IP})
+        await host.send_str(json.dumps({"type": "join", "room": "BENCH1", "from": "host", "create": True}))
+        await host.receive()
+        await host.receive()
+
+        senders = []
+        for i in range(peers):
+            ws = await client.ws_connect("/ws", headers={"X-Forwarded-For": f"10.0.1.{i}"})
+            await ws.send_str(json.dumps({"type": "join", "room": "BENCH1", "from": f"peer{i}"}))
+            await ws.receive()
+            await host.receive()
+            senders.append(ws)
+
+        per_peer = frames // peers
+        frame = json.dumps({"type": "offer", "to_ip": HOST_IP, "sdp": "v=0\r\n" * 40, "sdpType": "offer"})
+
+        async def send(ws):
+            for _ in range(per_peer):
+                await ws.send_str(frame)
+
+        async def receive():
+            for _ in range(per_peer * peers):
+                msg = await host.receive()
+                assert msg.type == WSMsgType.TEXT, msg
+
+        start = time.perf_counter()
+        await asyncio.gather(receive(), *(send(ws) for ws in senders))
+        elapsed = time.perf_counter() - start
+
+        for ws in senders + [host]:
+            await ws.close()
+        return per_peer * peers / elapsed
+
+class StallingStream:
+    """
+        File wrapper whose writes block, releasing the GIL like a blocked pipe would.
+    """
+    def __init__(self, stream, stall):
+        self._stream=stream
+        self._stall=stall
+
+    def write(self, text):
+        if self._stall:
+            time.sleep(self._stall)
+        return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+def configure(mode, stream):
+    """
+        Install one of the logging setups being compared. Returns a listener to stop, if any.
+    """
+    if mode == "sync":
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        logging.getLogger().handlers = [handler]
+        logging.getLogger().setLevel(logging.INFO)
+        logsetup.relay_log.logger.setLevel(logging.DEBUG)
+        logsetup.relay_log.rate = 1
+        return None
+    relay_level = "WARNING" if mode == "off" else "DEBUG"
+    sample = 100 if mode == "sampled" else 1
+    return logsetup.setup_logging(level="INFO", relay_level=relay_level, relay_sample=sample, stream=stream)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--peers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the best one is reported")
+    parser.add_argument("--stall-us", type=int, default=0, help="block every log write for this many microseconds")
+    args = parser.parse_args()
+
+    # The senders outpace the single receiver, keep the host from being evicted as a slow consumer
+    settings.OUTBOX_SIZE = args.frames
+    # A few peers flood on purpose, lift the rate limits
+    signaling_server.ip_limits.limits.clear()
+    signaling_server.room_limits.limits.clear()
+    asyncio.run(compare(args.frames, args.peers, args.repeat, args.stall_us / 1e6))
+
+async def compare(frames, peers, repeat, stall):
+    best = {}
+    with tempfile.TemporaryFile("w") as logfile:
+        stream = StallingStream(logfile, stall)
+        await relay_throughput(frames // 10, peers) # warm up
+        for _ in range(repeat):
+            for mode in MODES:
+                listener = configure(mode, stream)
+                rate = await relay_throughput(frames, peers)
+                if listener:
+                    listener.stop()
+                best[mode] = max(best.get(mode, 0), rate)
+    for mode, rate in best.items():
+        print(f"relay log {mode:>7}: {rate:10.0f} frames/s ({rate / best['off']:.0%} of off)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Memory held by the room registry: bytes per room and per connected user.
+
+Creates --rooms rooms through RoomRegistry, each with its owner connected,
+then has --guests users join every room, and reports what tracemalloc sees
+allocated at each step. Usernames, room codes and addresses are decoded from
+JSON frames the way the server gets them, so duplicated strings are counted.
+Connections are a single shared object: their outboxes are not room state.
+
+    python server/bench/bench_memory.py --rooms 10000 100000 --guests 1
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import codec
+from registry import RoomRegistry
+from user import Users
+
+PASSWORD_HASH = hashlib.sha256(b"").hexdigest()
+CONNECTION = object()
+
+def address(i):
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+def join_frame(room_code, username, ip):
+    """
+        What the server decodes for one join: a room code and a username from the
+        frame, and an address from the X-Forwarded-For header.
+    """
+    frame = codec.loads(codec.dumps({"type": "join", "room": room_code, "from": username}))
+    return frame["room"], frame["from"], codec.loads(codec.dumps(ip))
+
+async def measure(rooms, guests):
+    """
+        Returns (bytes per room with its owner, bytes per guest).
+    """
+    registry = RoomRegistry()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for i in range(rooms):
+        room_code, username, ip = join_frame(f"R{i:05X}", f"host{i}", address(i))
+        async with registry.creating(room_code, PASSWORD_HASH, Users(username, ip), CONNECTION):
+            pass
+    with_owners = tracemalloc.get_traced_memory()[0]
+    for g in range(guests):
+        for i in range(rooms):
+            room_code, username, ip = join_frame(f"R{i:05X}", f"guest{g}", address(rooms * (g + 1) + i))
+            async with registry.locked(room_code) as room:
+                await registry.join(room, Users(username, ip), PASSWORD_HASH, CONNECTION)
+    with_guests = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(registry) == rooms
+    return (with_owners - start) / rooms, (with_guests - with_owners) / max(1, rooms * guests)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--guests", type=int, default=1, help="users joining every room besides its owner")
+    args = parser.parse_args()
+
+    print(f"{'rooms':>10}{'users':>10}{'bytes/room':>12}{'bytes/user':>12}{'total MB':>10}")
+    for rooms in args.rooms:
+        per_room, per_user = asyncio.run(measure(rooms, args.guests))
+        total = (per_room * rooms + per_user * rooms * args.guests) / 2 ** 20
+        print(f"{rooms:>10}{rooms * (1 + args.guests):>10}{per_room:>12.0f}{per_user:>12.0f}{total:>10.1f}")
+
+if __name__ == "__main__":
+    main()
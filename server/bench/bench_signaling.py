@@ -0,0 +1,142 @@
+"""
+Signaling server benchmark suite.
+
+Runs join, signaling (offer/answer/ice), chat broadcast and bye storms from
+loadgen.py against the app in-process and reports throughput, p50/p99 relay
+latency, server memory per connection and event loop lag.
+
+    python server/bench/bench_signaling.py --rooms 250 --peers 8
+    python server/bench/bench_signaling.py --repeat 3 --save-baseline default
+    python server/bench/bench_signaling.py --repeat 3 --compare default
+
+--compare exits with status 1 when a result is worse than the baseline by more
+than --tolerance. Baselines are machine specific, save one on the machine that
+runs the comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tracemalloc
+
+from loadgen import LagMonitor, LoadGenerator, percentile
+import signaling_server
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+APP_DIR = os.path.dirname(os.path.abspath(signaling_server.__file__))
+
+# Results where a larger value is better, every other numeric result is better when smaller
+HIGHER_IS_BETTER = ("_per_s",)
+# Results describing the run, or too noisy to gate on
+NOT_COMPARED = ("connections", "rooms", "peers", "loop_lag_max_ms")
+
+def better(name, a, b):
+    return max(a, b) if name.endswith(HIGHER_IS_BETTER) else min(a, b)
+
+def server_memory(snapshot):
+    """
+        Bytes allocated by the server side of the connections: the app itself and aiohttp's web_* modules.
+    """
+    server = snapshot.filter_traces((
+        tracemalloc.Filter(True, os.path.join(APP_DIR, "*"), all_frames=True),
+        tracemalloc.Filter(True, "*/aiohttp/web_*", all_frames=True),
+    ))
+    return sum(stat.size for stat in server.statistics("filename"))
+
+async def connection_memory(rooms, peers):
+    """
+        Server bytes per connection, measured on a separate traced join storm
+        because tracemalloc slows everything else down.
+    """
+    async with LoadGenerator(signaling_server.app, rooms, peers) as gen:
+        tracemalloc.start(25)
+        before = server_memory(tracemalloc.take_snapshot())
+        await gen.join_storm()
+        after = server_memory(tracemalloc.take_snapshot())
+        tracemalloc.stop()
+        await gen.bye_storm()
+        return (after - before) / gen.connections
+
+async def run(rooms, peers, ice, messages, memory_rooms):
+    results = {"rooms": rooms, "peers": peers}
+    lag = LagMonitor()
+    lags = []
+
+    async with LoadGenerator(signaling_server.app, rooms, peers) as gen:
+        storms = (gen.join_storm, lambda: gen.signaling_storm(ice), lambda: gen.chat_storm(messages), gen.bye_storm)
+        for storm in storms:
+            lag.start()
+            results.update(await storm())
+            await lag.stop()
+            lags += lag.samples
+
+    results["loop_lag_p99_ms"] = percentile(lags, 0.99) * 1000
+    results["loop_lag_max_ms"] = max(lags, default=0) * 1000
+    if memory_rooms:
+        results["server_bytes_per_connection"] = await connection_memory(memory_rooms, peers)
+    return results
+
+async def suite(args):
+    """
+        Run the benchmark args.repeat times, keeping the best value of each result.
+        Every run shares one event loop, the app can only be bound to one.
+    """
+    results = {}
+    for _ in range(args.repeat):
+        run_results = await run(args.rooms, args.peers, args.ice, args.messages, args.memory_rooms)
+        results = {name: better(name, value, results.get(name, value)) for name, value in run_results.items()}
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+        Print every result next to its baseline. Returns the names of the regressed results.
+    """
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None or name in NOT_COMPARED or not old:
+            continue
+        change = (value - old) / old
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:32} {value:14.3f} {old:14.3f} {change:+8.1%} {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=250)
+    parser.add_argument("--peers", type=int, default=8, help="clients per room, the host included")
+    parser.add_argument("--ice", type=int, default=4, help="ICE candidates sent by each side of a peer pair")
+    parser.add_argument("--messages", type=int, default=5, help="chat messages broadcast by each host")
+    parser.add_argument("--memory-rooms", type=int, default=10, help="rooms in the traced run measuring memory, 0 to skip it")
+    parser.add_argument("--repeat", type=int, default=1, help="run the suite several times and keep the best value of each result")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression for --compare")
+    args = parser.parse_args()
+
+    results = asyncio.run(suite(args))
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + ".json")) as f:
+            baseline = json.load(f)["results"]
+        print(f"{'result':32} {'now':>14} {'baseline':>14} {'change':>8}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressed:", ", ".join(regressions))
+            sys.exit(1)
+    else:
+        for name, value in results.items():
+            print(f"{name:32} {value:14.3f}")
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, args.save_baseline + ".json"), "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Event loop overhead of websocket heartbeats at high connection counts.
+
+Compares the per-socket timers of WebSocketResponse(heartbeat=...) with the
+server's shared timer wheel (timers.py), without any network traffic so only
+the timers are measured:
+
+  per-socket  every connection keeps its own loop timer. Each heartbeat is a
+              call_at for the ping and one for the pong timeout, the pong
+              cancels the timeout, and every received frame moves the
+              heartbeat (cancel + call_at), like aiohttp does.
+  wheel       one task advances the wheel every tick. Each heartbeat is one
+              wheel timer, a received frame only clears a flag.
+
+Pongs are simulated as answered at once and --rate frames per second are
+spread over random connections. The heartbeat interval is scaled down so that
+a few seconds of wall time cover several heartbeat rounds.
+
+    python server/bench/bench_timers.py --connections 10000 100000 --duration 5
+
+Reported per mode: seconds to set the connections up, CPU used by the loop
+as a share of the wall time, and how late a 10 ms sleep of an unrelated task
+wakes up (mean and max), which is what other clients feel.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import timers
+
+class SocketTimers:
+    """
+        Heartbeat of one connection on its own loop timers.
+    """
+    __slots__ = ("loop", "heartbeat", "ping_handle", "pong_handle", "pings")
+
+    def __init__(self, loop, heartbeat):
+        self.loop=loop
+        self.heartbeat=heartbeat
+        self.pong_handle=None
+        self.pings=0
+        self.ping_handle=loop.call_at(loop.time() + heartbeat * random.random(), self.send_ping)
+
+    def send_ping(self):
+        self.pings += 1
+        self.pong_handle = self.loop.call_at(self.loop.time() + self.heartbeat / 2, self.pong_missed)
+        self.received() # the pong
+
+    def pong_missed(self):
+        raise AssertionError("pongs are answered at once")
+
+    def received(self):
+        if self.pong_handle is not None:
+            self.pong_handle.cancel()
+            self.pong_handle = None
+        self.ping_handle.cancel()
+        self.ping_handle = self.loop.call_at(self.loop.time() + self.heartbeat, self.send_ping)
+
+    def close(self):
+        self.ping_handle.cancel()
+        if self.pong_handle is not None:
+            self.pong_handle.cancel()
+
+class WheelTimers:
+    """
+        Heartbeat of one connection on the shared wheel, as Session does it.
+    """
+    __slots__ = ("wheel", "heartbeat", "timer", "silent", "pings")
+
+    def __init__(self, wheel, heartbeat):
+        self.wheel=wheel
+        self.heartbeat=heartbeat
+        self.silent=False
+        self.pings=0
+        self.timer=wheel.schedule(heartbeat * random.random(), self.send_ping)
+
+    def send_ping(self):
+        if self.silent:
+            raise AssertionError("pongs are answered at once")
+        self.pings += 1
+        self.silent = True
+        self.timer = self.wheel.schedule(self.heartbeat, self.send_ping)
+        self.received() # the pong
+
+    def received(self):
+        self.silent = False
+
+    def close(self):
+        self.timer.cancel()
+
+async def traffic(conns, rate):
+    """
+        Deliver rate frames per second to random connections, in 10 ms batches.
+    """
+    per_batch = max(1, int(rate / 100))
+    while True:
+        await asyncio.sleep(0.01)
+        for conn in random.choices(conns, k=per_batch):
+            conn.received()
+
+async def probe(lags):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+async def measure(mode, n, heartbeat, tick, duration, rate):
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    if mode == "wheel":
+        wheel = timers.TimerWheel(tick, clock=loop.time)
+        conns = [WheelTimers(wheel, heartbeat) for _ in range(n)]
+        runner = asyncio.create_task(wheel.run())
+    else:
+        conns = [SocketTimers(loop, heartbeat) for _ in range(n)]
+        runner = None
+    setup = time.perf_counter() - start
+
+    lags = []
+    tasks = [asyncio.create_task(traffic(conns, rate)), asyncio.create_task(probe(lags))]
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    for task in tasks + ([runner] if runner else []):
+        task.cancel()
+    for conn in conns:
+        conn.close()
+    pings = sum(conn.pings for conn in conns)
+    return setup, cpu / wall, sum(lags) / len(lags), max(lags), pings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--heartbeat", type=float, default=1.0, help="seconds between pings, scaled down from the server's 30")
+    parser.add_argument("--tick", type=float, default=0.05, help="resolution of the wheel in seconds")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=5000, help="received frames per second over all connections")
+    args = parser.parse_args()
+
+    print(f"heartbeat {args.heartbeat}s, wheel tick {args.tick}s, {args.rate:.0f} frames/s, {args.duration}s per run")
+    print(f"{'connections':>12}{'mode':>12}{'setup s':>10}{'loop CPU':>10}{'lag ms':>9}{'max ms':>9}{'pings':>10}")
+    for n in args.connections:
+        for mode in ("per-socket", "wheel"):
+            random.seed(n)
+            setup, cpu, lag, lag_max, pings = asyncio.run(
+                measure(mode, n, args.heartbeat, args.tick, args.duration, args.rate)
+            )
+            print(f"{n:>12}{mode:>12}{setup:>10.2f}{cpu:>10.0%}{lag * 1e3:>9.2f}{lag_max * 1e3:>9.1f}{pings:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+In-process load generator for the signaling server.
+
+Drives signaling_server.app on an aiohttp test server bound to loopback with
+thousands of synthetic websocket clients. Every relayed frame carries the
+perf_counter() time it was sent so the receiving client can measure the
+relay latency; clients and server share one event loop and one clock.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+# A realistic offer body: about 2.5 KB of SDP, plus the PEM public key ChatClient attaches
+SDP = "".join(
+    f"a=candidate:{i} 1 udp 2130706431 192.168.1.{i} {50000 + i} typ host\r\n" for i in range(12)
+) + "v=0\r\no=- 3900000000 3900000000 IN IP4 0.0.0.0\r\ns=-\r\nt=0 0\r\n" + "a=fingerprint:sha-256 " + "AB:" * 31 + "AB\r\n" * 8
+PUBKEY = "-----BEGIN PUBLIC KEY-----\n" + ("A" * 64 + "\n") * 6 + "-----END PUBLIC KEY-----\n"
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class LagMonitor:
+    """
+        Measures how late the event loop wakes up a task that sleeps `interval` seconds.
+    """
+    def __init__(self, interval=0.01):
+        self.interval=interval
+        self.samples=[]
+        self._task=None
+
+    def start(self):
+        self.samples=[]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+class SyntheticPeer:
+    """
+        One websocket client. Frames that carry a send time are turned into latency samples.
+    """
+    def __init__(self, gen, ip, name, room):
+        self.gen=gen
+        self.ip=ip
+        self.name=name
+        self.room=room
+        self.ws=None
+        self._waiters={} # {frame type: Future}
+        self._reader=None
+
+    async def connect(self):
+        self.ws = await self.gen.client.ws_connect("/ws", headers={"X-Forwarded-For": self.ip})
+        self._reader = asyncio.create_task(self._read())
+
+    def expect(self, frame_type):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[frame_type] = future
+        return future
+
+    async def send(self, payload):
+        await self.ws.send_str(json.dumps(payload))
+
+    async def close(self):
+        await self.ws.close()
+        await self._reader
+
+    async def _read(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            t = data.get("type")
+            sent_at = data.get("t")
+            if t == "message":
+                sent_at = float(data["text"])
+            if sent_at is not None:
+                self.gen.delivered(time.perf_counter() - sent_at)
+            waiter = self._waiters.pop(t, None)
+            if waiter and not waiter.done():
+                waiter.set_result(data)
+            elif t == "error":
+                for waiter in self._waiters.values():
+                    waiter.set_exception(RuntimeError(f"{self.name}: {data.get('message')}"))
+                self._waiters.clear()
+
+class LoadGenerator:
+    """
+        Creates `rooms` rooms of `peers` clients each and runs storms against them.
+        Every storm returns a dict of results.
+    """
+    def __init__(self, app, rooms, peers, concurrency=200):
+        self.app=app
+        self.rooms=rooms
+        self.peers=peers
+        self.client=None
+        self.hosts=[]
+        self.guests=[]
+        self._gate=asyncio.Semaphore(concurrency)
+        self._latencies=[]
+        self._expected=0
+        self._done=None
+
+    async def __aenter__(self):
+        server = TestServer(self.app)
+        self.client = TestClient(server, connector=aiohttp.TCPConnector(limit=0))
+        await self.client.start_server()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.close()
+
+    @property
+    def connections(self):
+        return len(self.hosts) + len(self.guests)
+
+    def delivered(self, latency):
+        self._latencies.append(latency)
+        if self._done is not None and len(self._latencies) >= self._expected:
+            self._done.set()
+
+    async def _measure(self, name, expected, send):
+        """
+            Run send() and wait until `expected` timed frames have been delivered.
+        """
+        self._latencies=[]
+        self._expected=expected
+        self._done=asyncio.Event()
+        start = time.perf_counter()
+        await send()
+        if expected:
+            await asyncio.wait_for(self._done.wait(), timeout=max(30, expected / 100))
+        elapsed = time.perf_counter() - start
+        self._done=None
+        return {
+            f"{name}_frames_per_s": expected / elapsed if elapsed else 0.0,
+            f"{name}_p50_ms": percentile(self._latencies, 0.50) * 1000,
+            f"{name}_p99_ms": percentile(self._latencies, 0.99) * 1000,
+        }
+
+    async def _gated(self, coro):
+        async with self._gate:
+            return await coro
+
+    async def join_storm(self):
+        """
+            Connect every client, create one room per host and join all guests concurrently.
+        """
+        for r in range(self.rooms):
+            code = f"R{r:05d}"
+            self.hosts.append(SyntheticPeer(self, f"10.{r // 250}.{r % 250}.1", f"host{r}", code))
+            for p in range(1, self.peers):
+                self.guests.append(SyntheticPeer(self, f"10.{r // 250}.{r % 250}.{p + 1}", f"guest{p}", code))
+
+        latencies = []
+        async def join(peer, create):
+            await peer.connect()
+            reply = peer.expect("created" if create else "joined")
+            start = time.perf_counter()
+            await peer.send({"type": "join", "room": peer.room, "from": peer.name, "create": create})
+            await reply
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self._gated(join(host, True)) for host in self.hosts))
+        await asyncio.gather(*(self._gated(join(guest, False)) for guest in self.guests))
+        elapsed = time.perf_counter() - start
+        return {
+            "connections": self.connections,
+            "joins_per_s": self.connections / elapsed,
+            "join_p50_ms": percentile(latencies, 0.50) * 1000,
+            "join_p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+
+    async def signaling_storm(self, ice_per_peer=4):
+        """
+            Every guest offers to its host, the host answers, then both sides trickle ICE.
+        """
+        host_ip = {host.room: host.ip for host in self.hosts}
+        hosts = {host.room: host for host in self.hosts}
+
+        async def negotiate(guest):
+            now = time.perf_counter
+            await guest.send({"type": "offer", "to_ip": host_ip[guest.room], "sdp": SDP, "sdpType": "offer", "pubKey": PUBKEY, "t": now()})
+            host = hosts[guest.room]
+            await host.send({"type": "answer", "to_ip": guest.ip, "sdp": SDP, "sdpType": "answer", "t": now()})
+            for i in range(ice_per_peer):
+                candidate = {"candidate": f"candidate:{i} 1 udp 2130706431 192.168.1.{i} {50000 + i} typ host", "sdpMid": "0"}
+                await guest.send({"type": "ice", "to_ip": host.ip, "candidate": candidate, "t": now()})
+                await host.send({"type": "ice", "to_ip": guest.ip, "candidate": candidate, "t": now()})
+
+        async def send():
+            await asyncio.gather(*(self._gated(negotiate(guest)) for guest in self.guests))
+
+        return await self._measure("signaling", len(self.guests) * (2 + 2 * ice_per_peer), send)
+
+    async def chat_storm(self, messages=5):
+        """
+            Every host broadcasts chat messages to its room, the sender included.
+        """
+        async def chat(host):
+            for _ in range(messages):
+                await host.send({"type": "message", "text": repr(time.perf_counter())})
+
+        async def send():
+            await asyncio.gather(*(self._gated(chat(host)) for host in self.hosts))
+
+        return await self._measure("chat", self.rooms * self.peers * messages, send)
+
+    async def bye_storm(self):
+        """
+            Every guest broadcasts bye to its room and everyone disconnects.
+        """
+        async def bye(guest):
+            await guest.send({"type": "bye", "t": time.perf_counter()})
+
+        async def send():
+            await asyncio.gather(*(self._gated(bye(guest)) for guest in self.guests))
+
+        result = await self._measure("bye", len(self.guests) * (self.peers - 1), send)
+        await asyncio.gather(*(self._gated(peer.close()) for peer in self.hosts + self.guests))
+        return result